@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+#
+# Benchmark of hystfit
+#
+# Each benchmark is timed with timeit (best of repeats), its peak memory is
+# measured with tracemalloc, and its error is measured against a reference
+# calculated with the adaptive integrator at high precision: the maximum error
+# of ln(h + 1) for h, and the maximum error of the parameters for opt and
+# init_hyst.
+#
+# Usage:
+#   ./benchmark.py                       # print the result
+#   ./benchmark.py -o result.json        # save the result
+#   ./benchmark.py -c previous.json      # compare with a saved result
+#   ./benchmark.py -k opt                # run benchmarks whose name contains opt
+import importlib.util
+import math
+import sys
+import numpy as np
+
+
+def load_module(path):
+    module_name = path.split('/')[-2]
+    spec = importlib.util.spec_from_file_location(
+        module_name, path, submodule_search_locations=[path.rsplit('/', 1)[0]])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+hystfit = load_module('../hystfit/__init__.py')
+
+# Paths of Fig. 6 in Zhou (2013), the same as docs/zhou/zhou-2013-fig6.py
+ZHOU = {'a': (85, 0.3, (0.70, 0.55, 0.90, 0.80)),
+        'b': (85, 0.6, (0.85, 0.55, 0.95, 0.80)),
+        'c': (70, 0.3, (0.92, 0.91, 0.55, 0.98)),
+        'd': (70, 0.6, (0.92, 0.91, 0.55, 0.98))}
+# Settings of integrators
+SETTINGS = {'legacy': {'integrator': 'legacy', 'delta_theta': 0.0001},
+            'legacy_coarse': {'integrator': 'legacy', 'delta_theta': 0.001},
+            'adaptive': {'integrator': 'adaptive'},
+            'adaptive_table': {'integrator': 'adaptive', 'table_rtol': 1e-8}}
+# Parameters of the drying curves, where the table is used only for DV
+MODELS = {'VG': (0.33, 0, 1 / 180, 1.65), 'FX': (0.35, 0, 45, 1.25, 7.23),
+          'DV': (0.33, 0, 0.6, 1 / 100, 2.5, 1 / 1000, 1.6)}
+REFERENCE = {'integrator': 'adaptive', 'rtol': 1e-9,
+             'atol': 1e-7, 'max_step': 1000000}
+P_TRUE = (math.cos(math.radians(75)), 0.24)
+
+
+def new_fit(settings, model='VG'):
+    f = hystfit.Fit()
+    f.no_warn = True
+    f.cache_size = 0  # Measure the calculation, not the cache
+    for key, value in settings.items():
+        setattr(f, key, value)
+    f.set_drying_curve(model, *MODELS[model])
+    return f
+
+
+def bench_h_zhou(settings, model='VG'):
+    """h on the paths of Fig. 6 in Zhou (2013) with theta_s = 1"""
+    f = new_fit(settings)
+    f.set_drying_curve(model, 1, *MODELS[model][1:])
+    ref = new_fit(REFERENCE)
+    ref.set_drying_curve(model, 1, *MODELS[model][1:])
+    paths = []
+    for angle, b, theta_hyst in ZHOU.values():
+        p = (math.cos(math.radians(angle)), b)
+        x = (1, 0.07, 1, 0.3) + theta_hyst
+        ref.cos_g0 = 1
+        paths.append((p, x, np.array(ref.h(p, x))))
+
+    def run():
+        error = 0
+        for p, x, h_ref in paths:
+            f.cos_g0 = 1
+            theta = f.smooth_theta(x)
+            h = np.array(f.h(p, theta))
+            # Index of x in theta, where each interval of smooth_theta has
+            # floor(|dx| / delta) + 2 points
+            index = np.cumsum([0] + [math.floor(abs(x[i] - x[i - 1]) / 0.005) + 2
+                                     for i in range(1, len(x))])
+            h = h[np.maximum(index - 1, 0)]
+            error = max(error, np.max(np.abs(np.log((h + 1) / (h_ref + 1)))))
+        return error
+    return run
+
+
+def wetting_data(model):
+    """Synthetic wetting data from the reference"""
+    f = new_fit(REFERENCE, model)
+    h_dry = np.array([1, 10, 30, 100, 300, 1000, 10000])
+    dry = h_dry, f.theta_s * f.dry_se(h_dry)
+    theta = np.array([0.5, 0.6, 0.7, 0.8, 0.9]) * f.theta_s
+    f.cos_g0 = f.contact(f.dry_h(0.45), 0.45 * f.theta_s)
+    return dry, (np.array(f.h(P_TRUE, theta)), theta)
+
+
+def bench_opt(settings, model):
+    """opt on synthetic wetting data"""
+    f = new_fit(settings, model)
+    h, theta = wetting_data(model)[1]
+
+    def run():
+        f.opt(h, theta)
+        return max(abs(f.hyst[i] - P_TRUE[i]) for i in range(2))
+    return run
+
+
+def bench_init_hyst(settings, model):
+    """init_hyst on synthetic drying data"""
+    f = new_fit(settings, model)
+    dry = wetting_data(model)[0]
+    theta_s = f.theta_s
+
+    def run():
+        f.swrc = dry
+        f.model_name = model
+        f.init_hyst()
+        return abs(f.theta_s - theta_s)
+    return run
+
+
+def bench_smooth_theta(settings):
+    """smooth_theta of a long path with 10000 reversal points"""
+    f = new_fit(settings)
+    x = np.random.default_rng(0).uniform(0.1, 0.3, 10000)
+
+    def run():
+        f.smooth_theta(x)
+        return 0
+    return run
+
+
+def benchmarks():
+    """Dictionary of name: function returning the function to be timed"""
+    b = {}
+    for s in ['legacy', 'legacy_coarse', 'adaptive']:
+        b[f'h_zhou.{s}'] = lambda s=s: bench_h_zhou(SETTINGS[s])
+    for s in ['adaptive', 'adaptive_table']:
+        b[f'h_zhou.DV.{s}'] = lambda s=s: bench_h_zhou(SETTINGS[s], 'DV')
+    for model in ['VG', 'FX']:
+        for s in ['legacy', 'adaptive']:
+            b[f'opt.{model}.{s}'] = lambda s=s, m=model: bench_opt(
+                SETTINGS[s], m)
+        b[f'init_hyst.{model}'] = lambda m=model: bench_init_hyst({}, m)
+    b['smooth_theta'] = lambda: bench_smooth_theta({})
+    return b
+
+
+def measure(setup, repeat):
+    """Time, peak memory and error of a benchmark"""
+    import timeit
+    import tracemalloc
+    run = setup()
+    error = float(run())  # Warm up and measure error
+    timer = timeit.Timer(run)
+    number = max(1, int(0.2 / max(timer.timeit(1), 1e-6)))
+    time = min(timer.repeat(repeat, number)) / number
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'time': time, 'peakmem': peak, 'error': error}
+
+
+def main():
+    import argparse
+    import configparser
+    import json
+    import platform
+    parser = argparse.ArgumentParser(description='Benchmark of hystfit')
+    parser.add_argument('-o', '--output', help='save result as JSON')
+    parser.add_argument('-c', '--compare', help='compare with saved JSON')
+    parser.add_argument('-k', '--keyword', default='',
+                        help='run benchmarks whose name contains keyword')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='number of repeats of timing')
+    parser.add_argument('-t', '--threshold', type=float, default=1.2,
+                        help='ratio of time regarded as regression')
+    args = parser.parse_args()
+    inifile = configparser.ConfigParser()
+    inifile.read('../hystfit/data/system.ini')
+    result = {'version': inifile.get('system', 'version'),
+              'python': platform.python_version(),
+              'numpy': np.__version__,
+              'benchmarks': {}}
+    previous = {}
+    if args.compare:
+        with open(args.compare) as file:
+            previous = json.load(file)['benchmarks']
+    print(f'{"benchmark":<24} {"time (ms)":>10} {"peakmem (kB)":>13} {"error":>9}')
+    regression = False
+    for name, setup in benchmarks().items():
+        if args.keyword not in name:
+            continue
+        r = measure(setup, args.repeat)
+        result['benchmarks'][name] = r
+        line = f'{name:<24} {r["time"] * 1000:>10.3f} {r["peakmem"] / 1024:>13.1f} {r["error"]:>9.2e}'
+        if name in previous:
+            ratio = r['time'] / previous[name]['time']
+            line += f' {ratio:>6.2f}x'
+            if ratio > args.threshold:
+                line += ' REGRESSION'
+                regression = True
+        print(line, flush=True)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(result, file, indent=1)
+    if regression:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
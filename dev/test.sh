@@ -11,4 +11,4 @@ echo '=== mypy'
 mypy ../hystfit/*.py
 
 echo '=== flake8'
-flake8 --ignore=E501,W504 ../hystfit/hystfit.py
+flake8 --ignore=E501,W504 ../hystfit/*.py
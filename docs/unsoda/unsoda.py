@@ -4,36 +4,99 @@
 #
 # Author: Katsutoshi Seki
 # License: MIT License
+#
+# Usage:
+#   ./unsoda.py                       # download UNSODA data, fit and draw figures
+#   ./unsoda.py -m                    # output in markdown
+#   ./unsoda.py -d unsoda.json -j 8   # local data with 8 worker processes
+#   ./unsoda.py -n                    # time the fitting without figures
+#
+# Parsed samples are saved in unsoda-samples.json and reused in the next run.
+import sys
 import numpy as np
 
+UNSODA_URL = 'https://sekika.github.io/file/unsoda/unsoda.json'
+
 
 def main():
     import argparse
-    import requests
-    import hystfit
-    # Create fitting object f
-    f = hystfit.Fit()
+    import time
     # Output markdown when invoked with -m option
     parser = argparse.ArgumentParser(
         description='Fit UNSODA data with hystfit')
     parser.add_argument('-m', '--markdown',
                         action='store_true', help='output in markdown')
-    f.markdown = parser.parse_args().markdown
-    f.no_warn = f.markdown
+    parser.add_argument('-c', '--cache',
+                        help='directory of cache of fitting of drying curves')
+    parser.add_argument('-d', '--data', default=UNSODA_URL,
+                        help='URL or path of UNSODA data converted to JSON')
+    parser.add_argument('-s', '--store', default='unsoda-samples.json',
+                        help='file of parsed samples reused in the next run, or empty not to save')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('-n', '--no-figure', action='store_true',
+                        help='do not draw figures')
+    args = parser.parse_args()
+    start = time.perf_counter()
+    samples = load_samples(args.data, args.store)
+    options = {'markdown': args.markdown, 'cache': args.cache,
+               'figure': not args.no_figure}
+    results = run(samples, options, args.jobs)
+    # Output in the order of ID regardless of the order of completion
+    count_fig = 0
+    for id in sorted(results, key=int):
+        text, figure = results[id]
+        print(text, end='')
+        count_fig += figure
+    if not args.markdown:
+        print(f'{count_fig} figures were produced.')
+    # Throughput of the whole pipeline
+    elapsed = time.perf_counter() - start
+    print(f'{len(samples)} samples in {elapsed:.2f} s '
+          f'({len(samples) / elapsed:.2f} samples/s)', file=sys.stderr)
+
+
+def load_samples(source, store=None):
+    """Samples to be fitted from UNSODA data at source (URL or path)
+
+    The parsed samples are saved in the file store as compact JSON, and loaded
+    from it in the next run with the same source, so that the network is not
+    needed after the first run.
+    """
+    import json
+    import os
+    version = [source, None if '://' in source else os.path.getmtime(source)]
+    if store and os.path.exists(store):
+        with open(store) as file:
+            saved = json.load(file)
+        if saved['version'] == version:
+            return saved['samples']
     # Load UNSODA data converted to JSON
     # See document at https://sekika.github.io/file/unsoda/
-    unsoda_url = 'https://sekika.github.io/file/unsoda/unsoda.json'
-    response = requests.get(unsoda_url)
-    assert response.status_code == 200
-    j = response.json()
+    if '://' in source:
+        import requests
+        response = requests.get(source)
+        assert response.status_code == 200
+        j = response.json()
+    else:
+        with open(source) as file:
+            j = json.load(file)
+    samples = parse(j)
+    if store:
+        with open(store, 'w') as file:
+            json.dump({'version': version, 'samples': samples},
+                      file, separators=(',', ':'))
+    return samples
+
+
+def parse(j):
+    """List of samples in UNSODA data with the data needed for fitting"""
     # Load UNSODA tables
     general = j['general']
     dry = j['lab_drying_h-t']  # Laboratory drying curve
     wet = j['lab_wetting_h-t']  # Laboratory wetting curve
     prop = j['soil_properties']
-    f.pub_id = j['publication']
-    # Prepare data and call calculation functions
-    count_fig = 0
+    samples = []
     for id in dry:
         # Skip some data because
         # 4690: Identical drying and wetting curve (no hysteresis)
@@ -42,94 +105,98 @@ def main():
         # 4921: 2 wetting curves are mixed
         if int(id) in [4690, 4870, 4880, 4921]:
             continue
-        f.general = general[id]
         # Select data which have more than 3 data points in the wetting curve
-        if id in wet and len(wet[id][0]) > 3:
-            # Set drying data
-            h, t = dry[id]
-            f.swrc = (np.array(h), np.array(t))
-            # Check is theta_s is available
-            if 'theta_sat' in prop[id]:
-                qs = prop[id]['theta_sat']
-                if qs == '':
-                    f.qs = 0
-                else:
-                    f.qs = float(qs)
-            else:
-                f.qs = 0
-            # Set wetting data in the order of wetting
-            h, t = wet[id]
-            if t[0] > t[-1]:
-                h = h[::-1]
-                t = t[::-1]
-            f.swrc_wet = (np.array(h), np.array(t))
-            # Calculate parameters of drying curve
-            f = calc_dry(f)
-            # Select data with good the drying curve
-            if f.r2_ht < 0.98:
-                if not f.markdown:
-                    print(f'Skipping UNSODA {id} where R2 = {f.r2_ht:.3}')
-                continue
-            # Calculate parameters of the wetting curve
-            f = calc_wet(f)
-            # Output the result and draw a figure
-            output(f)
+        if id not in wet or len(wet[id][0]) <= 3:
+            continue
+        # Check is theta_s is available
+        qs = 0
+        if prop.get(id, {}).get('theta_sat', '') != '':
+            qs = float(prop[id]['theta_sat'])
+        # Set wetting data in the order of wetting
+        h, t = wet[id]
+        if t[0] > t[-1]:
+            h = h[::-1]
+            t = t[::-1]
+        g = general[id]
+        samples.append({'id': id, 'dry': dry[id], 'wet': [h, t], 'qs': qs,
+                        'general': {key: g[key] for key in
+                                    ('texture', 'keyword', 'publication_ID', 'code')},
+                        'publication': j['publication'].get(g['publication_ID'])})
+    return samples
+
+
+def run(samples, options, jobs=None):
+    """Process samples in a pool of worker processes, or in this process when jobs is 1
+
+    returns dictionary of {id: result of process}
+    """
+    import concurrent.futures
+    import functools
+    func = functools.partial(process, options=options)
+    ids = [sample['id'] for sample in samples]
+    if jobs == 1:
+        return dict(zip(ids, map(func, samples)))
+    with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+        return dict(zip(ids, pool.map(func, samples)))
+
+
+def process(sample, options):
+    """Fit a sample, output the result and draw a figure
+
+    Output is returned as text, so that results of worker processes are printed
+    in order.
+
+    returns (text, True if a figure is produced)
+    """
+    import contextlib
+    import io
+    import hystfit
+    # Create fitting object f
+    f = hystfit.Fit()
+    f.markdown = options['markdown']
+    f.no_warn = f.markdown
+    # Fitting of the drying curve is cached, so that unchanged data are not
+    # fitted in the next run
+    f.fit_cache = hystfit.FitCache(options['cache'])
+    f.general = sample['general']
+    f.publication = sample['publication']
+    f.qs = sample['qs']
+    h, t = sample['dry']
+    f.swrc = (np.array(h), np.array(t))
+    h, t = sample['wet']
+    f.swrc_wet = (np.array(h), np.array(t))
+    text = io.StringIO()
+    with contextlib.redirect_stdout(text):
+        # Calculate parameters of drying curve
+        f = calc_dry(f)
+        # Select data with good the drying curve
+        if f.r2_ht < 0.98:
+            if not f.markdown:
+                print(f'Skipping UNSODA {sample["id"]} where R2 = {f.r2_ht:.3}')
+            return text.getvalue(), False
+        # Calculate parameters of the wetting curve
+        f = calc_wet(f)
+        # Output the result and draw a figure
+        output(f)
+        if options['figure']:
             draw_figure(f)
-            count_fig += 1
-    if not f.markdown:
-        print(f'{count_fig} figures were produced.')
+    return text.getvalue(), options['figure']
 
 
 def calc_dry(f):
     """Calculation of drying curve"""
-    if f.qs == 0:
-        # theta_s is not measured
-        f.set_model('VG', const=['qr=0', 'q=1'])
-        f.ini = (max(f.swrc[1]), *f.get_init())
-        f.optimize()
-        vg_aic = f.aicc_ht
-        f.set_model('FX', const=['qr=0'])
-        f.ini = (max(f.swrc[1]), *f.get_init())
-        f.optimize()
-        # Compare corrected AIC of VG and FX
-        if vg_aic < f.aicc_ht:
-            f.set_model('VG', const=['qr=0', 'q=1'])
-            f.ini = (max(f.swrc[1]), *f.get_init())
-            f.optimize()
-            f.qs, a, m = f.fitted
-            n = 1 / (1 - m)
-            f.message_dry = f'qs = {f.qs:.3} alpha = {a:.3} n = {n:.3}'
-            f.qs_wet = qs_wet(f)
-            f.set_vg(f.qs_wet, 0, a, n)
-        else:
-            f.message_dry = f.message
-            f.qs, a, m, n = f.fitted
-            f.qs_wet = qs_wet(f)
-            f.set_fx(f.qs_wet, 0, a, m, n)
+    # Fit VG and FX concurrently and set the one with smaller corrected AIC.
+    # theta_s is fixed when it is measured, and it is not bounded otherwise.
+    f.b_qs_init = None
+    f.select_drying_model(('VG', 'FX'), theta_s=f.qs if f.qs else None)
+    f.qs = f.theta_s
+    if f.model_name == 'VG':
+        a, n = f.swrf_p
+        f.message_dry = f'qs = {f.qs:.3} alpha = {a:.3} n = {n:.3}'
     else:
-        # theta_s is measured
-        f.set_model('VG', const=[f'qs={f.qs}', 'qr=0', 'q=1'])
-        f.ini = f.get_init()
-        f.optimize()
-        vg_aic = f.aicc_ht
-        f.set_model('FX', const=[f'qs={f.qs}', 'qr=0'])
-        f.ini = f.get_init()
-        f.optimize()
-        # Compare corrected AIC of VG and FX
-        if vg_aic < f.aicc_ht:
-            f.set_model('VG', const=[f'qs={f.qs}', 'qr=0', 'q=1'])
-            f.ini = f.get_init()
-            f.optimize()
-            a, m = f.fitted
-            n = 1 / (1 - m)
-            f.message_dry = f'qs = {f.qs:.3} alpha = {a:.3} n = {n:.3}'
-            f.qs_wet = qs_wet(f)
-            f.set_vg(f.qs_wet, 0, a, n)
-        else:
-            f.message_dry = f.message
-            a, m, n = f.fitted
-            f.qs_wet = qs_wet(f)
-            f.set_fx(f.qs_wet, 0, a, m, n)
+        f.message_dry = f.message
+    f.qs_wet = qs_wet(f)
+    f.set_drying_curve(f.model_name, f.qs_wet, 0, *f.swrf_p)
     return f
 
 
@@ -168,7 +235,7 @@ def output(f):
     else:
         disturbed = d[1]
     pub_id = f.general['publication_ID']
-    publication = f.pub_id[pub_id]
+    publication = f.publication
     id = int(f.general['code'])
     if f.markdown:
         print(f'### <a name="{id}"></a>UNSODA {id} {texture} ({disturbed})')
@@ -198,6 +265,8 @@ def output(f):
 def draw_figure(f):
     """Draw a figure"""
     import math
+    import matplotlib
+    matplotlib.use('Agg')  # Draw without display in worker processes
     import matplotlib.pyplot as plt
     id = int(f.general['code'])
     min_x = 0.8
@@ -213,18 +282,18 @@ def draw_figure(f):
     ax1.set_xlabel('h (cm)')
     ax1.set_ylabel('$\\theta$')
     id = f.general['code']
+    # h = 0 is plotted at 1 on the log scale without changing the data
     h, t = f.swrc
-    h[h == 0] = 1
+    h = np.where(h == 0, 1, h)
     ax1.plot(h, t, marker='o', linestyle='', color='black', label='Drying')
     h, t = f.swrc_wet
-    h[h == 0] = 1
+    h = np.where(h == 0, 1, h)
     ax1.plot(h, t, marker='^', linestyle='',
              color='red', label='Wetting')
     x = 2**np.linspace(math.log2(min_x),
                        math.log2(max_x), num=f.curve_smooth)
     y = f.f_ht(f.fitted, x)
     ax1.plot(x, y, color='black', linestyle='dashed', label=f'{f.model_name}')
-    h, t = f.swrc_wet
     theta = f.smooth_theta((min(t), f.qs_wet))
     f.cos_g0 = f.contact(h[0], t[0])
     h_opt = f.h(f.hyst, theta)
@@ -236,6 +305,7 @@ def draw_figure(f):
     leg = fig.legend(title=f'UNSODA {id}', loc=loc)
     leg.get_frame().set_alpha(1)
     plt.savefig(f'unsoda{id}.png')
+    plt.close(fig)
 
 
 if __name__ == "__main__":
@@ -1,2 +1,19 @@
 """init.py."""
-from .hystfit import Fit
+from .cells import CellState
+from .fitcache import FitCache
+from .model import Model
+from .state import HysteresisState
+from .stats import Stats
+from . import batch, errors
+
+__all__ = ['Fit', 'Model', 'CellState', 'FitCache', 'HysteresisState', 'Stats',
+           'batch', 'errors']
+
+
+def __getattr__(name):
+    # Fit is imported when it is used, so that prediction with Model does not
+    # import unsatfit
+    if name == 'Fit':
+        from .hystfit import Fit
+        return Fit
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,200 @@
+"""Parallel fitting of hysteresis for many soil samples."""
+import numpy as np
+
+
+def fit_many(records, model='VG', workers=None, chunksize=1, options=None):
+    """Fit drying curves and hysteresis parameters of many samples in parallel
+
+    Each sample is fitted by fit_sample in a pool of worker processes, and the
+    results are yielded in the order of completion. The index of the record is
+    given in the result to identify the sample.
+
+    input
+
+        records : iterable of (dry, wet, theta_s)
+            dry = (h, theta) of the main drying curve
+            wet = (h, theta) of the wetting (or drying) process in the order of time
+            theta_s : saturated water content, or None to optimize it
+        model : 'VG', 'FX', 'BC', 'KO' or 'DV' for the main drying curve, or tuple of
+                them (see fit_sample)
+        workers : number of worker processes (number of CPUs when None).
+                  Samples are fitted in this process when workers is 1.
+        chunksize : number of records sent to a worker at once
+        options : dictionary of attributes of hystfit.Fit, e.g. {'integrator': 'adaptive'}
+
+    yields result dictionaries of fit_sample
+    """
+    import functools
+    import multiprocessing
+    fit = functools.partial(fit_indexed, model=model, options=options)
+    if workers == 1:
+        yield from map(fit, enumerate(records))
+        return
+    with multiprocessing.Pool(workers) as pool:
+        yield from pool.imap_unordered(fit, enumerate(records), chunksize)
+
+
+def fit_stream(samples, model='VG', workers=None, options=None, backlog=2):
+    """Fit a stream of samples in parallel with bounded memory
+
+    Unlike fit_many, which reads all records at once, samples are read only as
+    workers become free, so that a long stream, e.g. from a large file, is fitted
+    with at most backlog * workers samples in memory. The results are yielded in
+    the order of completion.
+
+    input
+
+        samples : iterable of (id, record), where record is (dry, wet, theta_s)
+                  as in fit_many
+        model, workers, options : the same as fit_many
+        backlog : number of samples submitted to each worker in advance
+
+    yields result dictionaries of fit_sample with the id of the sample
+    """
+    import concurrent.futures
+    import os
+    if workers == 1:
+        for id, record in samples:
+            yield {'id': id, **fit_sample(*record, model=model, options=options)}
+        return
+    limit = backlog * (workers or os.cpu_count() or 1)
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        pending = {}
+        for id, record in samples:
+            future = pool.submit(
+                fit_sample,
+                *record,
+                model=model,
+                options=options)
+            pending[future] = id
+            if len(pending) >= limit:
+                done, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    yield {'id': pending.pop(future), **future.result()}
+        for future in concurrent.futures.as_completed(pending):
+            yield {'id': pending[future], **future.result()}
+
+
+def fit_indexed(item, model='VG', options=None):
+    """Fit a sample given as (index, record) and add the index to the result"""
+    index, record = item
+    result = fit_sample(*record, model=model, options=options)
+    result['index'] = index
+    return result
+
+
+def fit_sample(dry, wet, theta_s=None, model='VG', options=None):
+    """Fit drying curve with init_hyst and hysteresis parameters with opt
+
+    Failure of a sample is returned as a result instead of being raised.
+
+    input
+
+        dry = (h, theta) of the main drying curve
+        wet = (h, theta) of the wetting (or drying) process in the order of time
+        theta_s : saturated water content, or None to optimize it
+        model : 'VG', 'FX', 'BC', 'KO' or 'DV' for the main drying curve, or tuple
+                of them to select the model by select_drying_model
+        options : dictionary of attributes of hystfit.Fit
+
+    returns dictionary of
+        success : True if both of the drying curve and hysteresis are fitted
+        error : description of the failure, or None
+        error_index, error_value : index and value of the failing data point
+                                   given by hystfit.errors.HystfitError
+        model, theta_s, theta_r, swrf_p : parameters of the drying curve
+        r2_dry : coefficient of determination of the drying curve
+        hyst : hysteresis parameters (cos(gamma_A), b)
+        r2 : coefficient of determination of the hysteresis
+        message : message of opt
+    """
+    from .errors import HystfitError
+    from .hystfit import Fit
+    result = {'success': False, 'error': None, 'model': model}
+    f = Fit()
+    f.no_warn = True
+    for key, value in (options or {}).items():
+        setattr(f, key, value)
+    try:
+        f.swrc = (np.array(dry[0], dtype=float), np.array(dry[1], dtype=float))
+        if isinstance(model, str):
+            f.model_name = model
+            f.init_hyst(theta_s)
+        else:
+            f.select_drying_model(model, theta_s)
+        if not f.success:
+            result['error'] = f'Fitting of drying curve failed: {f.message}'
+            return result
+        result.update(model=f.model_name, theta_s=f.theta_s, theta_r=f.theta_r,
+                      swrf_p=tuple(f.swrf_p), r2_dry=f.r2_ht)
+        f.opt(np.array(wet[0], dtype=float), np.array(wet[1], dtype=float))
+        result['message'] = f.message
+        if not f.success:
+            result['error'] = f'Fitting of hysteresis failed: {f.message}'
+            return result
+        result.update(success=True, hyst=tuple(f.hyst), r2=f.r2)
+    except HystfitError as e:
+        result.update(error=str(e), error_index=e.index, error_value=e.value)
+    except Exception as e:
+        result['error'] = f'{type(e).__name__}: {e}'
+    return result
+
+
+def fit_drying(swrc, model='VG', theta_s=None, options=None):
+    """Fit the drying curve with init_hyst
+
+    input
+
+        swrc = (h, theta) of the main drying curve
+        model : 'VG', 'FX', 'BC', 'KO' or 'DV'
+        theta_s : saturated water content, or None to optimize it
+        options : dictionary of attributes of hystfit.Fit
+
+    returns dictionary of the result of optimize method (see hystfit.FitCache.result)
+    """
+    from .fitcache import FitCache
+    from .hystfit import Fit
+    f = Fit()
+    f.no_warn = True
+    for key, value in (options or {}).items():
+        setattr(f, key, value)
+    f.swrc = swrc
+    f.model_name = model
+    f.init_hyst(theta_s)
+    return FitCache.result(f)
+
+
+# hystfit.Fit built by refit in each thread of a worker process {thread:
+# (key, fit)}
+FITS: dict = {}
+
+
+def refit(params, options, task):
+    """Refit hysteresis parameters for Fit.confidence in a worker
+
+    hystfit.Fit is built with the parameters (see hystfit.Model.params) and options
+    for the first task, and reused for the following tasks with the same ones, so
+    that the drying curve is set and tabulated only once in a worker.
+
+    input
+
+        params : parameters given by params method of hystfit.Fit
+        options : dictionary of attributes of hystfit.Fit
+        task : arguments of refit method of hystfit.Fit
+
+    returns (p, rss, success) of refit method of hystfit.Fit
+    """
+    import json
+    import threading
+    from .hystfit import Fit
+    key = json.dumps([params, options], sort_keys=True, default=repr)
+    ident = threading.get_ident()
+    cached = FITS.get(ident)
+    if cached is None or cached[0] != key:
+        f = Fit()
+        for name, value in options.items():
+            setattr(f, name, value)
+        f.set_params(params)
+        cached = FITS[ident] = (key, f)
+    return cached[1].refit(*task)
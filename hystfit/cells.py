@@ -0,0 +1,88 @@
+"""Hysteresis of many cells for coupling with flow simulators."""
+import numpy as np
+from .errors import InputError, NumericalError
+
+
+class CellState:
+    """Hysteresis state of many cells advanced together as numpy arrays
+
+    Each cell has its own water content, h and contact angle, and all cells are
+    advanced from the current water content to a new one with step(theta_new) by the
+    array integrator selected by fit.integrator. Cells can be drying, wetting or
+    unchanged in the same step. With the adaptive integrator, h of each cell agrees
+    with Fit.h of its path up to rounding errors. With the legacy integrator, it agrees
+    with Fit.h_batch, which can differ from Fit.h where drying reaches the main drying
+    curve.
+
+    Per-cell parameters of the drying curve are given by setting the drying curve
+    of fit with arrays of shape (k,), e.g. f.set_vg(theta_s, theta_r, alpha, n) with
+    arrays, where the tabulated drying curve (f.table_rtol) cannot be used.
+
+    input
+
+        fit : hystfit.Fit object with the drying curve set
+        p = (cos(theta_A), b) for all cells, or array of shape (k, 2) for each cell
+        theta : initial water content of the cells, array of shape (k,)
+        h : initial h of the cells, or None to calculate it from cos_g0
+        cos_g0 : cos of the initial contact angle (scalar or array of shape (k,)),
+                 fit.cos_g0 is used when it is None
+    """
+
+    def __init__(self, fit, p, theta, h=None, cos_g0=None):
+        self.fit = fit
+        self.theta = np.array(theta, dtype=float)
+        k = len(self.theta)
+        P = np.broadcast_to(np.asarray(p, dtype=float), (k, 2))
+        self.cos_ga, self.b = P[:, 0].copy(), P[:, 1].copy()
+        self.check(self.theta)
+        if h is None:
+            if cos_g0 is None:
+                cos_g0 = fit.cos_g0
+            h = fit.dry_h(self.se(self.theta)) * cos_g0 / fit.cos_gr
+        self.h = np.array(np.broadcast_to(h, (k,)), dtype=float)
+        # step size of the adaptive integrator
+        self.step_size = np.full(k, 0.01)
+        self.set_contact()
+
+    def se(self, theta):
+        """Effective saturation of the cells"""
+        f = self.fit
+        return (theta - f.theta_r) / (f.theta_s - f.theta_r)
+
+    def check(self, theta):
+        """Check the range of water content"""
+        below = theta < self.fit.theta_r
+        if below.any():
+            i = int(np.argmax(below))
+            raise InputError(
+                'Water content below residual value is found.', index=i, value=theta[i])
+
+    def step(self, theta_new):
+        """Advance all cells to theta_new and return h of the cells"""
+        f = self.fit
+        theta_new = np.array(
+            np.broadcast_to(theta_new, self.theta.shape), dtype=float)
+        self.check(theta_new)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            if f.integrator == 'adaptive':
+                se = np.minimum(self.se(self.theta), f.max_se)
+                target = np.minimum(self.se(theta_new), f.max_se)
+                self.h = f.h_segment_array(self.h, se, target, self.cos_ga, self.b,
+                                           self.step_size)
+            else:
+                self.h, theta_new = f.h_segment_array_legacy(
+                    self.h, self.theta, theta_new, self.cos_ga, self.b)
+        if np.isnan(self.h).any():
+            i = int(np.argmax(np.isnan(self.h)))
+            raise NumericalError(
+                'Error: h was not calculated.', index=i, value=theta_new[i])
+        self.theta = theta_new
+        self.set_contact()
+        return self.h
+
+    def set_contact(self):
+        """Calculate cos of the contact angle of the cells as self.cos_g"""
+        f = self.fit
+        hd = f.dry_h(np.minimum(self.se(self.theta), f.max_se))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.cos_g = np.where(hd > 0, f.cos_gr * self.h / hd, f.cos_gr)
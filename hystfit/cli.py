@@ -0,0 +1,172 @@
+"""hystfit command: fit samples read as a stream of JSON lines or CSV.
+
+Each sample is a JSON line
+
+    {"id": "1", "dry": [[h, ...], [theta, ...]], "wet": [[h, ...], [theta, ...]],
+     "theta_s": 0.4}
+
+where theta_s is optional, or rows of CSV in long format with columns
+id, curve (dry or wet), h, theta and optional theta_s, where the rows of a sample
+are consecutive. The result of each sample is written as a JSON line as soon as it
+is fitted (see hystfit.batch.fit_sample).
+"""
+import json
+import sys
+
+
+def main(argv=None):
+    import argparse
+    from .batch import fit_stream
+    parser = argparse.ArgumentParser(
+        prog='hystfit',
+        description='Fit drying curves and hysteresis parameters of samples')
+    parser.add_argument('files', nargs='*',
+                        help='files of samples, or - for standard input (default)')
+    parser.add_argument('-f', '--format', choices=['jsonl', 'csv'],
+                        help='format of the files (default: csv for *.csv, jsonl otherwise)')
+    parser.add_argument('-o', '--output',
+                        help='file of results in JSON lines (default: standard output)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes (default: 1)')
+    parser.add_argument('-m', '--models', default='VG,FX',
+                        help='candidate models of the drying curve among VG, FX, BC, KO '
+                        'and DV (default: VG,FX)')
+    parser.add_argument('-i', '--integrator', choices=['legacy', 'adaptive'],
+                        default='adaptive', help='integrator (default: adaptive)')
+    parser.add_argument('-r', '--resume', action='store_true',
+                        help='skip samples whose id is in the output and append to it')
+    args = parser.parse_args(argv)
+    if args.resume and args.output is None:
+        parser.error('--resume requires --output')
+    if args.jobs < 1:
+        parser.error('--jobs must be positive')
+    done = finished(args.output) if args.resume else set()
+    models = tuple(args.models.split(','))
+    options = {'integrator': args.integrator, 'no_warn': True}
+    out = sys.stdout
+    if args.output is not None:
+        out = open(args.output, 'a' if args.resume else 'w')
+    invalid = []  # Samples which cannot be read
+
+    def samples():
+        for sample in read(args.files or ['-'], args.format):
+            if str(sample['id']) in done:
+                continue
+            if 'error' in sample:
+                invalid.append(sample)
+                continue
+            yield sample['id'], (sample['dry'], sample['wet'], sample['theta_s'])
+    try:
+        for result in fit_stream(samples(), models, args.jobs, options):
+            while invalid:
+                write(out, invalid.pop(0))
+            write(out, result)
+        while invalid:
+            write(out, invalid.pop(0))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+def read(files, format=None):
+    """Generator of samples in files
+
+    A sample is a dictionary of id, dry, wet and theta_s, or a result of failure
+    with id, success and error when it cannot be read.
+    """
+    for name in files:
+        file = sys.stdin if name == '-' else open(name, newline='')
+        try:
+            if (format or ('csv' if name.endswith('.csv') else 'jsonl')) == 'csv':
+                yield from read_csv(file)
+            else:
+                yield from read_jsonl(file)
+        finally:
+            if file is not sys.stdin:
+                file.close()
+
+
+def read_jsonl(file):
+    """Generator of samples in JSON lines"""
+    for n, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        r = None
+        try:
+            r = json.loads(line)
+            yield {'id': r['id'], 'dry': tuple(r['dry']), 'wet': tuple(r['wet']),
+                   'theta_s': r.get('theta_s')}
+        except (ValueError, KeyError, TypeError) as e:
+            id = r.get('id', f'line {n}') if isinstance(
+                r, dict) else f'line {n}'
+            yield failure(id, f'Invalid sample at line {n}: {e!r}')
+
+
+def read_csv(file):
+    """Generator of samples in CSV of long format"""
+    import csv
+    import itertools
+    reader = csv.DictReader(file)
+    for id, rows in itertools.groupby(reader, key=lambda row: row.get('id')):
+        curves = {'dry': ([], []), 'wet': ([], [])}
+        theta_s = None
+        try:
+            for row in rows:
+                if row['curve'] not in curves:
+                    raise ValueError(
+                        f'curve must be dry or wet, not {row["curve"]!r}')
+                h, theta = curves[row['curve']]
+                h.append(float(row['h']))
+                theta.append(float(row['theta']))
+                if row.get('theta_s'):
+                    theta_s = float(row['theta_s'])
+        except (KeyError, TypeError, ValueError) as e:
+            yield failure(id, f'Invalid sample: {e!r}')
+            continue
+        yield {'id': id, 'dry': curves['dry'], 'wet': curves['wet'],
+               'theta_s': theta_s}
+
+
+def failure(id, error):
+    """Result of a sample which cannot be read"""
+    return {'id': id, 'success': False, 'error': error}
+
+
+def finished(path):
+    """Set of id (as str) of the results in the file of path
+
+    An incomplete last line, e.g. left by an interrupted run, is removed.
+    """
+    import os
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, 'rb+') as file:
+        end = 0
+        for line in file:
+            if not line.endswith(b'\n'):
+                break
+            end += len(line)
+            try:
+                done.add(str(json.loads(line)['id']))
+            except (ValueError, KeyError, TypeError):
+                pass
+        file.truncate(end)
+    return done
+
+
+def write(file, result):
+    """Write a result as a JSON line"""
+    file.write(json.dumps(result, default=encode) + '\n')
+    file.flush()
+
+
+def encode(value):
+    """Convert numpy values for JSON"""
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    return repr(value)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+"""Exceptions raised by hystfit."""
+
+
+class HystfitError(Exception):
+    """Base class of exceptions in hystfit
+
+    input
+
+        message : description of the error
+        index : index of the failing data point, or None
+        value : failing value, or None
+    """
+
+    def __init__(self, message, index=None, value=None):
+        super().__init__(message)
+        self.index = index
+        self.value = value
+
+
+class InputError(HystfitError, ValueError):
+    """Invalid input data such as h = 0 or water content below residual value"""
+
+
+class NumericalError(HystfitError, ArithmeticError):
+    """Failure of numerical calculation such as NaN of h"""
+
+
+class ModelNotSupported(HystfitError, NotImplementedError):
+    """Model of drying curve which is not implemented in hystfit"""
@@ -0,0 +1,118 @@
+"""Cache of results of fitting the drying curve, in memory and on disk."""
+import json
+import os
+import numpy as np
+
+# Attributes set by unsatfit.Fit.optimize, which are saved in the cache
+RESULT = ('success', 'message', 'fitted', 'ini', 'mean_theta', 'var_theta',
+          'ht_only', 'mse_ht', 'rss', 'se_ht', 'r2_ht', 'aic_ht', 'aicc_ht',
+          'jac', 'dof', 'perr', 'cor')
+ARRAYS = ('fitted', 'jac', 'perr', 'cor')
+
+
+class FitCache:
+    """Content-addressed cache of results of optimize method of hystfit.Fit
+
+    A result is keyed by the hash of the water retention data, the model, constant
+    parameters, initial values, bounds and settings of the optimization, so that the
+    same fitting is not repeated, e.g. in a batch over mostly unchanged samples.
+    Results are kept in memory and, when path is given, saved as JSON files in the
+    directory, which can be shared by processes.
+
+    input
+
+        path : directory of the cache on disk, or None to keep it only in memory
+    """
+
+    version = 1  # Version of the format of the cache
+
+    def __init__(self, path=None):
+        self.path = path
+        self.memory = {}
+        self.hits = 0  # Number of results taken from the cache
+        self.misses = 0  # Number of results calculated
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    def key(self, fit):
+        """Hash of the data and settings of fitting of the drying curve"""
+        import hashlib
+        data = {'version': self.version,
+                'unsatfit': fit.version(),
+                'swrc': [np.asarray(a, dtype=float) for a in fit.swrc],
+                'model': fit.model_name,
+                'const': fit.const,
+                'ini': fit.ini,
+                'bounds': fit.b_func(),
+                'lsq': (fit.lsq_ftol, fit.lsq_method, fit.lsq_loss, fit.lsq_jac,
+                        fit.lsq_max_nfev)}
+        text = json.dumps(data, default=self.encode, sort_keys=True)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    @staticmethod
+    def encode(value):
+        """Convert numpy arrays and other objects for JSON"""
+        if hasattr(value, 'tolist'):
+            return value.tolist()
+        return repr(value)
+
+    def get(self, key):
+        """Result of the key, or None when it is not in the cache"""
+        if key not in self.memory and self.path is not None:
+            try:
+                with open(self.file(key)) as f:
+                    self.memory[key] = json.load(f)
+            except (OSError, ValueError):
+                pass
+        result = self.memory.get(key)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    def put(self, key, result):
+        """Save the result of the key"""
+        self.memory[key] = result
+        if self.path is None:
+            return
+        import tempfile
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(result, f, default=self.encode)
+        os.replace(tmp, self.file(key))  # Atomic for other processes
+
+    def file(self, key):
+        """Path of the file of the key"""
+        return os.path.join(self.path, f'{key}.json')
+
+    def clear(self):
+        """Remove all results in memory and on disk"""
+        self.memory.clear()
+        if self.path is None:
+            return
+        for name in os.listdir(self.path):
+            if name.endswith('.json'):
+                os.remove(os.path.join(self.path, name))
+
+    @staticmethod
+    def result(fit):
+        """Dictionary of the result of optimize method of fit
+
+        Only success, message, fitted and ini are saved when the fitting failed.
+        """
+        names = RESULT if fit.success else RESULT[:4]
+        return {name: getattr(fit, name)
+                for name in names if hasattr(fit, name)}
+
+    @staticmethod
+    def restore(fit, result):
+        """Set the result to fit"""
+        for name, value in result.items():
+            if name in ARRAYS and value is not None:
+                value = np.array(value)
+            elif name == 'ini':
+                value = tuple(value)
+            setattr(fit, name, value)
+        if fit.success and result.get('perr') is None:
+            fit.cov = None
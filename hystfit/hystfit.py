@@ -1,12 +1,20 @@
 import math
 import numpy as np
 import unsatfit
+from .errors import InputError, ModelNotSupported, NumericalError
+from .model import Model
 
+# Constant parameters of the models of unsatfit for the drying curve with
+# theta_r = 0 in init_hyst, where q = 1 gives m = 1 - 1/n of VG
+DRYING_CONST = {'VG': ['qr=0', 'q=1'], 'FX': ['qr=0'], 'BC': ['qr=0'], 'KO': ['qr=0'],
+                'DV': ['qr=0', 'q=1']}
 
-class Fit(unsatfit.Fit):
+
+class Fit(Model, unsatfit.Fit):
     """hystfit - Fit soil water retention function with hysteresis
 
-    Implementation of Zhao model as a subclass of unsatfit.Fit class.
+    Implementation of Zhao model as a subclass of unsatfit.Fit class. Calculation
+    of hysteresis is inherited from hystfit.Model, which depends only on NumPy.
 
     Zhao, A. (2013) A contact angle-dependent hysteresis model for soil–water retention behaviour,
          Computers and Geotechnics 49: 36-42. https://doi.org/10.1016/j.compgeo.2012.10.004
@@ -20,114 +28,173 @@ class Fit(unsatfit.Fit):
 
     def __init__(self):
         super(Fit, self).__init__()
-        self.debug = False
-        self.no_warn = False
-        # cos(gamma_R), where gamma_R is the receding contact angle
-        self.cos_gr = 1
-        # cos(gamma_0), where gamma_0 is the initial contact angle
-        self.cos_g0 = 1
-        self.delta_theta = 0.0001  # step of calculation of d_theta
-        self.delta_h = 1  # step of calculation of d_h when dSe/dt is small
-        self.dry_se = lambda h: False  # Mark that drying curve is not set
         self.lsq_ftol_hyst = 1e-8  # Tolerance of least square optimization
-        self.max_se = 1  # Maximum Se
+        # Use Jacobian by sensitivity equations in opt with adaptive integrator
+        self.sensitivity = True
         # Bound of parameters
         self.b_cos_g = (0, 1)
         self.b_b = (0, 1)
+        # Bound of theta_s in init_hyst relative to the maximum water content, or
+        # None to use self.b_qs
+        self.b_qs_init = (0.99, 1.1)
+        # Cache of fitting of the drying curve (hystfit.FitCache), or None
+        self.fit_cache = None
+        self.drying_results = {}  # Results of select_drying_model
+        # Number of points sampled for multi-start of opt, or 0 for single
+        # start
+        self.opt_seeds = 0
+        self.opt_sampling = 'grid'  # Sampling of the points: 'grid' or 'lhs'
+        self.opt_starts = 3  # Maximum number of starts from the best points
+        # Starts converging within this distance of parameters are the same
+        self.opt_atol = 1e-4
+        self.starts = []  # Starting points and results of least_squares in opt
+        # Confidence intervals [[low, high] of cos(gamma_A), [low, high] of b]
+        self.ci = None
+        self.ci_samples = None  # Hysteresis parameters of the bootstrap samples
+        # (values, deviance) of the profiles of parameters
+        self.ci_profiles = None
 
-    def init_hyst(self):
-        import sys
-        if self.model_name == 'VG':
-            a, m = self.get_init_vg()
-            qs = max(self.swrc[1])
-            self.set_model('VG', const=['qr=0', 'q=1'])
-            self.ini = (qs, a, m)
-            self.b_qs = (qs * 0.99, qs * 1.1)
+    def init_hyst(self, theta_s=None):
+        """Fit the drying curve to self.swrc with theta_r = 0 and set it
+
+        theta_s is optimized when it is None, and fixed to the given value otherwise.
+        """
+        with self.phase('init_hyst'):
+            self.set_drying_model(theta_s)
             self.optimize()
-            qs, a, m = self.fitted
-            qr = 0.0
-            n = 1 / (1 - m)
-            self.set_vg(qs, qr, a, n)
-        elif self.model_name == 'FX':
-            a, m, n = self.get_init_fx()
+            if self.success:
+                self.set_drying(theta_s)
+
+    def drying_const(self, theta_s=None):
+        """Constant parameters of self.model_name with theta_r = 0 for init_hyst"""
+        if self.model_name not in DRYING_CONST:
+            raise ModelNotSupported(
+                f'Model name {self.model_name} is not implemented in hystfit.', value=self.model_name)
+        const = DRYING_CONST[self.model_name]
+        if theta_s is not None:
+            const = [f'qs={theta_s}'] + const
+        return const
+
+    def set_drying_model(self, theta_s=None):
+        """Set self.model_name, initial values and bounds for fitting in init_hyst"""
+        self.set_model(self.model_name, const=self.drying_const(theta_s))
+        ini = tuple(self.get_init())
+        if theta_s is None:
             qs = max(self.swrc[1])
-            self.set_model('FX', const=['qr=0'])
-            self.ini = (qs, a, m, n)
-            self.b_qs = (qs * 0.99, qs * 1.1)
-            self.optimize()
-            qs, a, m, n = self.fitted
-            qr = 0.0
-            self.set_fx(qs, qr, a, m, n)
+            self.ini = (qs,) + ini
+            if self.b_qs_init is not None:
+                self.b_qs = (qs * self.b_qs_init[0], qs * self.b_qs_init[1])
         else:
-            print(
-                f'Model name {self.model_name} is not implemented in hystfit.')
-            sys.exit(1)
-
-    # VG model (van Genuchten, 1980)
-
-    def set_vg(self, theta_s, theta_r, alpha, n):
-        self.dry_se = self.vg_seh  # Se(h)
-        self.dry_h = self.vg_h  # h(Se)
-        self.dry_c = self.vg_c  # dSe/dh
-        self.theta_s = theta_s
-        self.theta_r = theta_r
-        self.swrf_p = alpha, n
-        self.cos_g0 = 1
-
-    def vg_seh(self, h):  # Se(h)
-        alpha, n = self.swrf_p  # VG parameter
-        return (1 + (alpha * h)**n)**(1 / n - 1)
-
-    def vg_h(self, se):  # inverse of Se(h): h(Se)
-        alpha, n = self.swrf_p  # VG parameter
-        h = (se**(n / (1 - n)) - 1)**(1 / n) / alpha
-        return h
-
-    def vg_c(self, h):  # derivative of Se(h): dSe/dh
-        alpha, n = self.swrf_p
-        if h == 0:
-            return 0
-        dsedh = (1 - n) / h * (1 + (alpha * h) **
-                               n)**((1 - 2 * n) / n) * (alpha * h)**n
-        return dsedh
-
-    # FX model (Fredlund and Xing, 1994)
-
-    def set_fx(self, theta_s, theta_r, a, m, n):
-        self.dry_se = self.fx_seh  # Se(h)
-        self.dry_h = self.fx_h  # h(Se)
-        self.dry_c = self.fx_c  # dSe/dh
-        self.theta_s = theta_s
-        self.theta_r = theta_r
-        self.swrf_p = a, m, n
-        self.cos_g0 = 1
-
-    def fx_seh(self, h):  # Se(h)
-        a, m, n = self.swrf_p  # FX parameter
-        return (np.log(np.e + (h / a)**n))**(-m)
-
-    def fx_h(self, se):  # inverse of Se(h): h(Se)
-        import warnings
-        # supress RuntimeWarning: invalid value encountered in double_scalars
-        warnings.simplefilter("ignore")
-        a, m, n = self.swrf_p  # FX parameter
-        return np.where(se >= 1, 0, a * (np.exp(se**(-1 / m)) - np.e)**(1 / n))
+            self.ini = ini
+
+    def set_drying(self, theta_s=None):
+        """Set the drying curve from self.fitted of init_hyst"""
+        p = list(self.fitted)
+        qs = p.pop(0) if theta_s is None else theta_s
+        qr = 0.0
+        if self.model_name == 'VG':
+            a, m = p
+            p = [a, 1 / (1 - m)]
+        elif self.model_name == 'DV':
+            w1, a1, m1, a2, m2 = p
+            p = [w1, a1, 1 / (1 - m1), a2, 1 / (1 - m2)]
+        self.set_drying_curve(self.model_name, qs, qr, *p)
+
+    def select_drying_model(self, candidates=(
+            'VG', 'FX'), theta_s=None, executor=None):
+        """Fit the drying curve with candidate models concurrently and set the best one
+
+        Each candidate is fitted as init_hyst by hystfit.batch.fit_drying, and the
+        candidate with the smallest corrected AIC is set as the drying curve without
+        fitting again. The results of optimize method of the candidates are kept in
+        self.drying_results, and another candidate can be set by use_drying_model.
+
+        input
+
+            candidates : names of the models, 'VG', 'FX', 'BC', 'KO' or 'DV'
+            theta_s : theta_s fixed in the fitting, or None to optimize it
+            executor : concurrent.futures.Executor, e.g. ProcessPoolExecutor, or None
+                       to fit the candidates in threads
+
+        returns list of dictionaries of model, success, aicc, r2 and message of the
+        candidates in the order of corrected AIC
+        """
+        import concurrent.futures
+        from .batch import fit_drying
+        options = {key: value for key, value in vars(self).items()
+                   if key.startswith(('b_', 'lsq_'))}
+        options.update(fit_cache=self.fit_cache, no_warn=self.no_warn)
+        pool = executor or concurrent.futures.ThreadPoolExecutor(
+            len(candidates))
+        try:
+            futures = {model: pool.submit(fit_drying, self.swrc, model, theta_s, options)
+                       for model in candidates}
+            self.drying_results = {model: future.result()
+                                   for model, future in futures.items()}
+        finally:
+            if executor is None:
+                pool.shutdown()
+        table = [{'model': model, 'success': r['success'], 'aicc': r.get('aicc_ht'),
+                  'r2': r.get('r2_ht'), 'message': r['message']}
+                 for model, r in self.drying_results.items()]
+        table.sort(key=lambda r: (not r['success'], r['aicc'] is None, r['aicc']
+                                  if r['aicc'] is not None else 0))
+        if table and table[0]['success']:
+            self.use_drying_model(table[0]['model'], theta_s)
+        else:
+            self.success = False
+            self.message = 'Fitting of drying curve failed with all candidates.'
+        return table
+
+    def use_drying_model(self, model, theta_s=None):
+        """Set the drying curve of a candidate fitted by select_drying_model
+
+        The result of the fitting, e.g. self.fitted and self.r2_ht, is also set.
+        """
+        from .fitcache import FitCache
+        self.model_name = model
+        self.set_model(model, const=self.drying_const(theta_s))
+        FitCache.restore(self, self.drying_results[model])
+        self.set_drying(theta_s)
+
+    def optimize(self):
+        """Optimize parameters with unsatfit, using self.fit_cache when it is set
 
-    def fx_c(self, h):  # derivative of Se(h): dSe/dh
-        a, m, n = self.swrf_p  # FX parameter
-        return -m * self.fx_seh(h)**(1 + 1 / m) * n / \
-            a * (h / a)**(n - 1) / (np.e + (h / a)**n)
+        Only fitting of the water retention curve without hydraulic conductivity is
+        cached.
+        """
+        cache = self.fit_cache
+        if cache is None or len(self.unsat) == 2:
+            return super(Fit, self).optimize()
+        key = cache.key(self)
+        result = cache.get(key)
+        if result is None:
+            super(Fit, self).optimize()
+            cache.put(key, cache.result(self))
+        else:
+            cache.restore(self, result)
 
     # Test
 
     def test(self):
+        import warnings
         f = Fit()
         # Test FX model
+        filters = list(warnings.filters)
         f.set_fx(0.35, 0.02, 45, 1.25, 7.23)
         f.test_model()
+        assert warnings.filters == filters, 'Warning filters are changed'
+        # Functions of FX model are the same as those before hystfit.kernels
+        a, m, n = f.swrf_p
+        for h in [300.0, np.array([30, 300.0])]:
+            se = np.log(np.e + (h / a)**n)**(-m)
+            assert np.all(f.fx_seh(h) == se)
+            assert np.all(f.fx_h(se) == a * (np.exp(se**(-1 / m)) - np.e)**(1 / n))
+            assert np.all(f.fx_c(h) == -m * se**(1 + 1 / m) * n / a *
+                          (h / a)**(n - 1) / (np.e + (h / a)**n))
         # Set parameters in Zhou (2013) and test VG model
         f.set_vg(0.33, 0.05, 1 / 180, 1.65)  # theta_s and theta_r is random
-        p = (math.cos(math.radians(75)), 0.24)
+        p = np.array((math.cos(math.radians(75)), 0.24))
         f.test_model()
         # Test h method
         se = np.array([1, 0.99, 0.8, 0.7, 0.58, 0.6, 0.62, 0.7, 0.8, 0.9])
@@ -140,6 +207,12 @@ class Fit(unsatfit.Fit):
         self.check(int(f.contact(100, 0.2) * 100000), 56289)
         # Test smooth_theta method
         self.check(int(sum(self.smooth_theta(se) * 1000)), 124795)
+        cos_g0 = f.cos_g0
+        smooth = f.smooth_theta(x, p=p, tol=0.01)
+        assert len(smooth) < len(
+            f.smooth_theta(
+                x, 0.001)) and f.cos_g0 == cos_g0
+        assert smooth[0] == x[0] and smooth[-1] == x[-1]
         # Test opt method
         h = np.array([460, 100, 60, 40, 22])
         se = np.array([0.5, 0.6, 0.7, 0.8, 0.9])
@@ -147,6 +220,371 @@ class Fit(unsatfit.Fit):
         f.opt(h, x)
         assert f.r2 > 0.999, f'Precision error. R2 = {f.r2:.5f}'
         self.check(int(sum(f.hyst) * 1000000), 501368)
+        # Test confidence intervals
+        import concurrent.futures
+        for method in ['bootstrap', 'profile']:
+            ci = f.confidence(h, x, method, n=6, workers=1)
+            assert np.all(ci[:, 0] <= f.hyst) and np.all(f.hyst <= ci[:, 1])
+            with concurrent.futures.ThreadPoolExecutor(1) as executor:
+                assert np.allclose(f.confidence(h, x, method, n=6, executor=executor),
+                                   ci)
+        # Test multi-start of opt
+        hyst, starts = f.hyst, f.starts
+        for f.opt_sampling in ['grid', 'lhs']:
+            f.opt_seeds = 16
+            f.opt(h, x)
+            assert 1 < len(f.starts) <= f.opt_starts
+            assert np.allclose(f.hyst, hyst, atol=1e-4)
+            assert min(
+                r.cost for _,
+                r in f.starts) <= starts[0][1].cost + 1e-12
+        f.opt_seeds = 0
+        # Test joint optimization of branches
+        f.opt_joint([(h, x), (h, x)])
+        assert np.allclose(f.hyst, hyst, atol=1e-4)
+        # Joint and single optimization give the same fit with the same number of
+        # integrations where drying reaches the main drying curve, where the legacy
+        # integrator jumps along it depending on rounding
+        from .stats import Stats
+        f.integrator = 'adaptive'
+        x_joint = np.array([0.5, 0.7, 0.4, 0.3, 0.6, 0.8, 0.35]) * \
+            (f.theta_s - f.theta_r) + f.theta_r
+        h_joint = np.array(f.h(p, x_joint, cont=False, cos_g0=0.9)) * \
+            (1, 1.05, 0.97, 1.02, 0.96, 1.03, 1)
+        fits = []
+        for method in [lambda: f.opt_joint([(h_joint, x_joint)]),
+                       lambda: f.opt(h_joint, x_joint)]:
+            f.clear_cache()
+            f.stats = Stats()
+            method()
+            fits.append((f.hyst, f.mse, f.stats.h))
+        f.stats = None
+        assert np.allclose(fits[0][0], fits[1][0], rtol=1e-6) and \
+            math.isclose(fits[0][1], fits[1][1], rel_tol=1e-6) and \
+            fits[0][2] == fits[1][2], \
+            'Error of joint optimization on the main drying curve'
+        f.integrator = 'legacy'
+        f.opt(h, x)
+        # Test cache of h method
+        assert f.cache_hits > 0 and len(f.cache) > 0
+        cos_g0 = f.cos_g0
+        h_cache = f.h(f.hyst, x, cont=False)
+        f.set_vg(0.33, 0.05, 1 / 180, 1.65)
+        assert len(f.cache) == 0
+        f.cos_g0 = cos_g0
+        assert f.h(f.hyst, x, cont=False) == h_cache
+        # Test reentrant evaluation by threads sharing f
+        P = [(cos_ga, b) for cos_ga in (0.2, 0.3) for b in (0.2, 0.5)] * 4
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(
+                lambda p: f.evaluate(p, x, 0.9), P))
+        assert f.cos_g0 == cos_g0
+        for q, (h_eval, cos_g) in zip(P, results):
+            assert np.array_equal(h_eval, f.h(q, x, cont=False, cos_g0=0.9))
+            assert cos_g == f.contact(h_eval[-1], x[-1])
+        # Test performance counters
+        phases = []
+        hyst = f.hyst
+        f.stats = Stats(hook=lambda phase, stats: phases.append(phase))
+        f.opt(h, x)
+        s = f.stats
+        assert np.array_equal(f.hyst, hyst) and phases == ['opt', 'statistics']
+        assert s.cost > 0 and s.dsedh > 0 and s.dry_h > 0 and s.dry_c > 0
+        assert s.steps == sum(n * k for n, k in s.segment_steps.items())
+        assert s.as_dict()['time_opt'] > 0
+        counters = s.as_dict()
+        f.stats = None
+        f.h(hyst, x, cont=False)
+        assert s.as_dict() == counters and not hasattr(f.dry_h, 'wrapped')
+        # Test prediction with parameters of the fit without unsatfit
+        import os
+        import subprocess
+        import sys
+        from .predict import Predictor
+        g = Predictor(f.params())
+        assert g.params() == f.params()
+        assert np.array_equal(g.predict(x), f.h(f.hyst, x))
+        assert g.cos_g0 == f.cos_g0
+        code = 'import sys, hystfit.predict; assert "unsatfit" not in sys.modules'
+        path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        subprocess.run([sys.executable, '-c', code], cwd=path, check=True)
+        # Test file of many models with a tabulated drying curve
+        import tempfile
+        from .predict import load_models, save_models
+        g.table_rtol = 1e-8
+        g.set_dv(0.35, 0.02, 0.6, 1 / 20, 2.5, 1 / 3000, 1.6)
+        g.hyst = f.hyst
+        with tempfile.TemporaryDirectory() as tmp:
+            file = os.path.join(tmp, 'models.hystfit')
+            save_models(file, [f, g])
+            models = load_models(file)
+            assert len(models) == 2 and isinstance(models.records, np.memmap)
+            for m, model in zip([f, g], models):
+                assert model.params() == m.params()
+                assert np.array_equal(model.predict(x, cont=False),
+                                      m.h(m.hyst, x, cont=False))
+            assert np.array_equal(models[1].table.s, g.table.s)
+        # Test adaptive integrator against small step of legacy integrator
+        se = np.array([0.58, 0.7, 0.65, 0.9])
+        x = se * (f.theta_s - f.theta_r) + f.theta_r
+        f.delta_theta = 0.00001
+        f.cos_g0 = 1
+        h_legacy = np.array(f.h(p, x))
+        f.integrator = 'adaptive'
+        f.cos_g0 = 1
+        h = np.array(f.h(p, x))
+        assert max(abs(h / h_legacy - 1)
+                   ) < 0.001, 'Precision error of adaptive integrator'
+        self.check(int(sum(h) * 1000), 685033)
+        # Test theta method as the inverse of h method
+        cos_g0 = f.cos_g0
+        assert np.allclose(f.theta(p, h, cos_g0=1), x, rtol=0, atol=1e-5), \
+            'Precision error of theta method'
+        assert abs(f.cos_g0 - cos_g0) < 1e-4
+        # Test h_batch method
+        f.delta_theta = 0.001
+        P = np.array([p, (0.3, 0.5), (0.1, 0.9)])
+        for f.integrator in ['legacy', 'adaptive']:
+            h = f.h_batch(P, x, cos_g0=1)
+            for i in range(len(P)):
+                f.cos_g0 = 1
+                assert np.allclose(h[i], f.h(P[i], x), rtol=1e-9), \
+                    f'Precision error of h_batch with {f.integrator} integrator'
+        # Test h_batch method where drying reaches the main drying curve, where the
+        # legacy integrator jumps along it depending on rounding
+        g = Fit()
+        g.set_bc(0.33, 0, 60, 0.6)
+        se = np.array([0.58, 0.7, 0.65, 0.4, 0.3, 0.6, 0.2, 0.9])
+        P = np.column_stack((np.linspace(0.1, 0.8, 8), np.linspace(0.1, 2, 8)))
+        for m in [g, f]:
+            x = se * (m.theta_s - m.theta_r) + m.theta_r
+            m.integrator = 'adaptive'
+            h = m.h_batch(P, x, cos_g0=0.8)
+            for i in range(len(P)):
+                assert np.allclose(h[i], m.h(P[i], x, cos_g0=0.8), rtol=1e-9), \
+                    'Error of h_batch on the main drying curve'
+        # Test Jacobian by sensitivity equations against central difference
+        se = np.array([0.58, 0.7, 0.65, 0.75, 0.6])
+        x = se * (f.theta_s - f.theta_r) + f.theta_r
+        f.rtol = 1e-8
+        f.atol = 1e-6
+        h, jac = f.h_jac(p, x)
+        for i in range(2):
+            d = np.eye(2)[i] * 1e-5
+            diff = (np.array(f.h(p + d, x, cont=False)) -
+                    np.array(f.h(p - d, x, cont=False))) / 2e-5
+            assert np.allclose(jac[:, i], diff, rtol=1e-3, atol=1e-2), \
+                'Precision error of sensitivity equations'
+        # h_jac follows the same model as h method at b = 0, where k = 1, and it
+        # does not change the result of h method
+        h = f.h((0.3, 0), x, cont=False, cos_g0=0.8)
+        assert np.allclose(f.h_jac((0.3, 0), x, cos_g0=0.8)[0], h, rtol=1e-6)
+        assert f.h((0.3, 0), x, cont=False, cos_g0=0.8) == h
+        # Test opt method with Jacobian by sensitivity equations
+        f.rtol = 1e-5
+        f.atol = 1e-3
+        h = np.array([460, 100, 60, 40, 22])
+        se = np.array([0.5, 0.6, 0.7, 0.8, 0.9])
+        x = se * (f.theta_s - f.theta_r) + f.theta_r
+        f.opt(h, x)
+        assert f.r2 > 0.999, f'Precision error. R2 = {f.r2:.5f}'
+        # Test opt method with Jacobian by sensitivity equations at Se = max_se
+        f.max_se = 0.95
+        f.no_warn = True  # Se is fixed to max_se
+        x = np.array([0.5, 0.6, 0.8, 0.96, 0.9, 0.8]) * \
+            (f.theta_s - f.theta_r) + f.theta_r
+        h = np.array(f.h(p, x, cont=False, cos_g0=0.9))
+        f.opt(h, x)
+        assert np.allclose(f.hyst, p, rtol=1e-2), 'Error of opt at max_se'
+        f.max_se = 1
+        f.no_warn = False
+        # Test tabulated drying curve
+        se = np.array([0.58, 0.7, 0.65, 0.9, 0.3])
+        f.rtol = 1e-9
+        f.atol = 1e-7
+        for f.table_rtol in [None, 1e-8]:
+            f.set_dv(0.35, 0.02, 0.6, 1 / 20, 2.5, 1 / 3000, 1.6)
+            x = se * (f.theta_s - f.theta_r) + f.theta_r
+            h = np.array(f.h(p, x, cont=False))
+            f.swrf_p = 0.4, 1 / 50, 2, 1 / 1000, 1.4  # Table is rebuilt
+            h = np.concatenate((h, f.h(p, x, cont=False)))
+            if f.table_rtol is None:
+                h_exact = h
+        assert f.table is not None, 'Table of DV model is not built'
+        assert max(abs(h / h_exact - 1)) < 1e-7, 'Precision error of table'
+        # Functions of the other models, which are faster than the table, are kept
+        f.set_fx(0.35, 0.02, 45, 1.25, 7.23)
+        assert f.table is None and f.dry_h == f.kernel.h
+        f.table_rtol = None
+        # Test BC, KO and DV models with fitting of the drying curve and h by
+        # both integrators, where h is calculated by drying from saturation
+        h = np.array([0, 1, 3, 10, 30, 100, 300, 1000, 3000, 10000])
+        se = np.array([0.58, 0.7, 0.65, 0.9])
+        for model, swrf_p in [('BC', (60, 0.6)), ('KO', (300, 1.0)),
+                              ('DV', (0.6, 1 / 20, 2.5, 1 / 3000, 1.6))]:
+            g = Fit()
+            g.set_drying_curve(model, 0.33, 0, *swrf_p)
+            g.test_model()
+            assert np.allclose(g.dry_h(se), [g.dry_h(s) for s in se],
+                               rtol=1e-12), f'Error of array h(Se) of {model}'
+            g.swrc = h, g.theta_s * g.dry_se(h)
+            g.model_name = model
+            g.init_hyst(0.33)
+            assert g.dry_model == model and np.allclose(
+                g.swrf_p, swrf_p, rtol=1e-3), f'Error of init_hyst with {model}'
+            h_sat = g.h(p, [g.theta_s, 0.8 * g.theta_s], cos_g0=1)
+            assert h_sat[0] == g.dry_h(1) and h_sat[1] >= h_sat[0]
+            g.delta_theta = 0.00001
+            h_legacy = np.array(g.h(p, se * g.theta_s, cos_g0=1))
+            g.integrator = 'adaptive'
+            h_model = np.array(g.h(p, se * g.theta_s, cos_g0=1))
+            assert max(abs(h_model / h_legacy - 1)) < 0.001, \
+                f'Precision error of h with {model}'
+        # Test batch fitting
+        from .batch import fit_many
+        f.set_vg(0.33, 0, 1 / 180, 1.65)
+        h = np.array([0, 10, 30, 100, 300, 1000, 10000])
+        dry = h, f.theta_s * f.dry_se(h)
+        x = np.array([0.5, 0.6, 0.7, 0.8, 0.9]) * f.theta_s
+        f.cos_g0 = f.contact(f.dry_h(0.45), 0.45 * f.theta_s)
+        wet = np.array(f.h(p, x)), x
+        records = [(dry, wet, None), (dry, (wet[0] * 0, x), 0.33)]
+        result = sorted(fit_many(records, workers=1, options={'integrator': 'adaptive'}),
+                        key=lambda r: r['index'])
+        assert np.allclose(
+            result[0]['hyst'], p, rtol=1e-2), 'Error of batch fitting'
+        assert not result[1]['success'] and 'h=0' in result[1]['error']
+        assert result[1]['error_index'] == 0
+        # Test command line tool with resuming from an interrupted output
+        import json
+        from .cli import main
+        with tempfile.TemporaryDirectory() as tmp:
+            samples = os.path.join(tmp, 'samples.jsonl')
+            output = os.path.join(tmp, 'results.jsonl')
+            with open(samples, 'w') as file:
+                for i, (d, w, qs) in enumerate(records):
+                    file.write(json.dumps({'id': i, 'dry': d, 'wet': w, 'theta_s': qs},
+                                          default=lambda a: a.tolist()) + '\n')
+            main([samples, '-m', 'VG', '-o', output])
+            with open(output) as file:
+                lines = file.readlines()
+            with open(output, 'w') as file:
+                file.write(lines[0] + lines[1][:20])
+            main([samples, '-m', 'VG', '-o', output, '--resume'])
+            with open(output) as file:
+                results = [json.loads(line) for line in file]
+            assert [r['id'] for r in results] == [0, 1]
+            assert np.allclose(results[0]['hyst'], p, rtol=1e-2)
+        # Test cache of fitting of the drying curve
+        from .fitcache import FitCache
+        with tempfile.TemporaryDirectory() as tmp:
+            fitted = []
+            for cache in [FitCache(tmp), FitCache(tmp)]:
+                for i in range(2):
+                    g = Fit()
+                    g.fit_cache = cache
+                    g.swrc = dry
+                    g.model_name = 'VG'
+                    g.init_hyst()
+                    fitted.append((tuple(g.fitted), g.r2_ht, g.message))
+                assert cache.hits == 1 + (cache.misses == 0)
+            assert len(set(fitted)) == 1 and cache.misses == 0
+        # Test selection of drying model against init_hyst
+        g = Fit()
+        g.swrc = dry
+        table = g.select_drying_model()
+        assert [r['model'] for r in table] == ['VG', 'FX']
+        for r in table[::-1]:
+            h = Fit()
+            h.swrc = dry
+            h.model_name = r['model']
+            h.init_hyst()
+            g.use_drying_model(r['model'])
+            assert h.swrf_p == g.swrf_p and h.theta_s == g.theta_s
+            assert h.r2_ht == g.r2_ht == r['r2'] and h.message == g.message
+        # theta_s is fitted within self.b_qs when b_qs_init is None
+        g, h = Fit(), Fit()
+        g.swrc = h.swrc = dry
+        g.b_qs_init = h.b_qs_init = None
+        g.select_drying_model(('VG',))
+        h.model_name = 'VG'
+        h.init_hyst()
+        assert h.b_qs == (0, np.inf) and h.theta_s == g.theta_s
+        # Test dense output
+        f.set_vg(0.33, 0.05, 1 / 180, 1.65)
+        x = np.array([0.58, 0.9, 0.65, 0.8]) * 0.28 + 0.05
+        for f.integrator in ['legacy', 'adaptive']:
+            f.cos_g0 = 1
+            theta, h, cos_g = f.h_dense(p, x, n=100)
+            assert set(x) <= set(theta) and len(theta) < 100 + len(x)
+            assert min(cos_g) >= 0 and max(cos_g) <= 1 + 1e-12
+        # Nodes are the same as h method, also where the legacy integrator jumps
+        # along the main drying curve
+        for x in [x, np.array([0.9, 0.5, 0.8, 0.2, 0.7, 0.1]) * 0.28 + 0.05]:
+            for f.integrator in ['legacy', 'adaptive']:
+                f.cos_g0 = 1
+                se, h, node = f.trajectory(p, x)
+                cos_g0 = f.cos_g0
+                f.cos_g0 = 1
+                assert np.allclose(h[node], f.h(p, x), rtol=1e-12) and \
+                    f.cos_g0 == cos_g0, f'Error of dense output with {f.integrator}'
+        # Test streaming calculation with checkpoint
+        from .state import HysteresisState
+        x = np.array([0.58, 0.9, 0.65, 0.8, 0.7, 0.75, 0.6]) * 0.28 + 0.05
+        for f.integrator in ['legacy', 'adaptive']:
+            f.cos_g0 = 1
+            h = f.h(p, x, cont=False)
+            state = HysteresisState(f, p)
+            h_stream = list(state.update(x[:3]))
+            state = HysteresisState.restore(f, state.checkpoint())
+            for chunk in state.stream((x[3:5], x[5:])):
+                h_stream.extend(chunk)
+            assert h_stream == h, 'Error of streaming calculation'
+        # Test cells with their own parameters drying and wetting at the same
+        # time
+        from .cells import CellState
+        g = Fit()
+        g.integrator = 'adaptive'
+        g.rtol, g.atol = f.rtol, f.atol
+        g.set_vg(np.array([0.33, 0.4, 0.35]), 0.05,
+                 np.array([1 / 180, 0.01, 0.005]), np.array([1.65, 2, 1.4]))
+        P = np.array([p, (0.3, 0.5), (0.1, 0.9)])
+        x = np.array([[0.8, 0.6, 0.9], [0.6, 0.9, 0.5],
+                     [0.7, 0.95, 0.6]]) * 0.3 + 0.05
+        cells = CellState(g, P, x[0])
+        h = np.array([cells.h.copy()] + [cells.step(t).copy()
+                     for t in x[1:]]).T
+        for i in range(3):
+            f.integrator = 'adaptive'
+            f.set_vg(g.theta_s[i], 0.05, *(a[i] for a in g.swrf_p))
+            f.cos_g0 = 1
+            assert np.allclose(h[i], f.h(P[i], x[:, i]), rtol=1e-9), \
+                'Error of cells with adaptive integrator'
+        cells = CellState(f, P, np.full(3, x[0, 0]), cos_g0=1)
+        f.integrator = 'legacy'
+        h = np.array([cells.h.copy()] + [cells.step(t).copy()
+                     for t in x[1:, 0]]).T
+        assert np.array_equal(h, f.h_batch(P, x[:, 0], cos_g0=1)), \
+            'Error of cells with legacy integrator'
+        # Cells with their own parameters where drying reaches the main drying
+        # curve, where the legacy integrator jumps along it depending on rounding
+        g.integrator = f.integrator = 'adaptive'
+        x = np.array([[0.8, 0.6, 0.9], [0.4, 0.3, 0.5], [0.6, 0.95, 0.2],
+                      [0.2, 0.5, 0.7]]) * 0.3 + 0.05
+        cells = CellState(g, P, x[0], cos_g0=0.8)
+        h = np.array([cells.h.copy()] + [cells.step(t).copy()
+                     for t in x[1:]]).T
+        for i in range(3):
+            f.set_vg(g.theta_s[i], 0.05, *(a[i] for a in g.swrf_p))
+            assert np.allclose(h[i], f.h(P[i], x[:, i], cos_g0=0.8), rtol=1e-9), \
+                'Error of cells on the main drying curve'
+        f.integrator = 'legacy'
+        # Test exception of input error
+        try:
+            f.h(p, (0.2, -0.1, 0.3))
+            assert False, 'InputError was not raised'
+        except InputError as e:
+            assert e.index == 1 and e.value == -0.1
         if self.debug:
             print('Test complete without error.')
 
@@ -167,198 +605,105 @@ class Fit(unsatfit.Fit):
             prec = abs(d / dsedh - 1)
             assert prec < 10**(-6), 'Precision error of C(h) at h = {0:.3f}'.format(
                 h)
+            d = (self.dry_c(h + delta) - dsedh) / delta
+            prec = abs(d / self.dry_dc(h) - 1)
+            assert prec < 10**(-5), 'Precision error of dC/dh at h = {0:.3f}'.format(
+                h)
 
-    # Calculate dh from h, theta, d_theta, (cos_ga, b)
-
-    def dsedh(self, h, theta, d_theta, p):  # dSe/dh
-        import sys
-        if h == 0:
-            return 0
-        cos_ga, b = p  # hysteresis parameters: cos(theta_A) and b
-        # Calculate hd = h at drying curve
-        se = (theta - self.theta_r) / (self.theta_s - self.theta_r)
-        # Fix Se > max_se
-        if se > self.max_se:
-            se = self.max_se
-        hd = self.dry_h(se)
-        if math.isnan(hd):
-            print(f'Error: h was not calculated at Se = {se}')
-            sys.exit()
-        # Calculate cos_g = cos(theta)
-        if hd == 0:
-            cos_g = self.cos_gr
-        else:
-            cos_g = self.cos_gr * h / hd
-        # Calculate k of eq. 11 in Zhao (2013)
-        if d_theta < 0:  # when ds<0
-            k = cos_g - self.cos_gr
-        else:  # when ds>0
-            k = cos_ga - cos_g
-        k = k / (cos_ga - self.cos_gr)
-        if k < 0:
-            k = 0
-        if k > 1:
-            k = 1
-        k = k ** b
-        # Calculate dsedh = dSe/dh
-        dsedh = self.dry_c(hd)
-        if math.isnan(dsedh):
-            print(f'Error: dSe/dh was not calculated at h = {hd}')
-            sys.exit()
-        dsedh *= hd / h * (1 - k)
-        return dsedh
-
-    def h(self, p, x, cont=True):
-        """Calculate hysteresis
-
-        input
-
-            p = (cos(theta_A), b)
-            x = (theta_0, theta_1, theta_2, ...)
-            cont : if True, the last contact angle is remembered for the next initial value
-
-            self.cos_g0 : cos of the initial contact angle
-
-        returns (h1, h2, ...)
-        """
-        import sys
-        assert not math.isnan(self.cos_g0)
-        theta = x[0]
-        assert self.dry_se(0), print(
-            'Drying curve not set. Use set_vg or set_fx')
-        if max(x) > self.theta_s * self.max_se and not self.no_warn:
-            print(
-                f'Effective saturation exceeding {self.max_se} is fixed to {self.max_se}.')
-        if min(x) < self.theta_r:
-            print('Water content below residual value is found.')
-            sys.exit()
-
-        def se(theta):
-            return (theta - self.theta_r) / (self.theta_s - self.theta_r)
-        h = self.dry_h(se(theta)) * self.cos_g0 / self.cos_gr
-        ret = [h]
-        max_t = self.max_se * (self.theta_s - self.theta_r) + self.theta_r
-        for t in list(x)[1:]:
-            if t > max_t:
-                t = max_t
-            while t != theta:
-                dt = t - theta
-                if self.dry_se(
-                        h) * self.max_se < se(theta) and dt < 0 or h == 0:
-                    h = self.dry_h(se(theta))
-                    theta = t
-                    continue
-                if abs(dt) > self.delta_theta:
-                    dt = self.delta_theta * dt / abs(dt)
-                dse = dt / (self.theta_s - self.theta_r)
-                dsedh = self.dsedh(h, theta, dt, p)
-                if abs(dse) < self.delta_h * abs(dsedh):
-                    dh = dse / dsedh
-                else:
-                    dh = -self.delta_h * dt / abs(dt)
-                    dse = dh * dsedh
-                    dt = dse * (self.theta_s - self.theta_r)
-                h += dh
-                if h < 0:
-                    h = 0
-                theta += dt
-                if h > self.dry_h(se(theta)):
-                    h = self.dry_h(se(theta))
-            ret.append(h + 0)
-        if cont:
-            self.cos_g0 = self.contact(ret[-1], x[-1])
-            assert self.cos_g0 >= 0
-        return ret
-
-    def contact(self, h, theta):
-        """Get cosine of contact angle
-
-        input
-
-            h = pressure head
-            theta = water content
-
-        returns cos(contact angle)
-        """
-        se = theta / (self.theta_s - self.theta_r) + self.theta_r
-        if se >= 1:
-            return 1
-        cos_g = h / self.dry_h(se) * self.cos_gr
-        return cos_g
+    def seeds(self, ini, h_measured, theta, cos_g0):
+        """Starting points of multi-start of opt
 
-    def smooth_theta(self, theta, delta=0.005):
-        """Get theta for drawing smooth curve
+        self.opt_seeds points in the bounds of (cos(gamma_A), b) are sampled on a grid
+        or by Latin hypercube sampling (self.opt_sampling), and the cost of opt at
+        them and ini is evaluated at once with h_batch.
 
-        input
-            theta = (theta_0, theta_1, theta_2, ...)
-            delta = increment (upper limit)
-
-        returns (theta_0, theta_0+delta, ...., theta_1, ...)
+        returns self.opt_starts points with the smallest cost
         """
-        if len(theta) < 2:
-            return theta
-        prev = theta[0]
-        smooth = []
-        for t in theta[1:]:
-            num = math.floor(abs(t - prev) / delta) + 2
-            smooth = np.concatenate((smooth, np.linspace(prev, t, num=num)))
-            prev = t
-        return smooth
-
-    def opt(self, h_measured, theta):
-        """Optimize hysteresis parameters
-
-        input
+        lo, hi = np.array((self.b_cos_g, self.b_b), dtype=float).T
+        if self.opt_sampling == 'lhs':
+            rng = np.random.default_rng(0)
+            u = (np.array([rng.permutation(self.opt_seeds) for _ in range(2)]).T +
+                 rng.random((self.opt_seeds, 2))) / self.opt_seeds
+        else:
+            k = max(2, round(math.sqrt(self.opt_seeds)))
+            c = (np.arange(k) + 0.5) / k
+            u = np.stack(np.meshgrid(c, c, indexing='ij'), -1).reshape(-1, 2)
+        P = np.vstack((ini, lo + u * (hi - lo)))
+        with self.phase('seeds'):
+            try:
+                h = self.h_batch(P, theta, cos_g0=cos_g0)
+            except NumericalError:
+                h = np.full((len(P), len(theta)), np.nan)
+                for i, p in enumerate(P):
+                    try:
+                        h[i] = self.h(p, theta, cont=False, cos_g0=cos_g0)
+                    except NumericalError:
+                        pass
+            with np.errstate(divide='ignore', invalid='ignore'):
+                cost = np.sum(np.log(h / h_measured)**2, axis=1)
+        cost[~np.isfinite(cost)] = np.inf
+        return P[np.argsort(cost, kind='stable')[:self.opt_starts]]
 
-            h_measured = (h_0, h_1, h_2, ...)
-            theta = (theta_0, theta_1, theta_2, ...)
+    def check_data(self, h_measured, theta):
+        """Check (h, theta) for the optimization of hysteresis parameters
 
-        returns (cos(gamma_A), b)
+        returns (h_measured, theta) as arrays
         """
-        import copy
-        from scipy import optimize
-        import sys
+        h_measured = np.array(h_measured)
         if min(h_measured) < 0:
-            print('Input value error: h<0 is not allowed.')
-            sys.exit()
+            i = int(np.argmin(h_measured))
+            raise InputError('Input value error: h<0 is not allowed.',
+                             index=i, value=h_measured[i])
         omit = 'It is recommended to omit the saturated point in the optimization, ' + \
             'as a very small error in the predicted h can cause a large error ' + \
             'in ln(h) in the cost function.'
         if min(h_measured) == 0:
-            print('Input value error: h=0 is not allowed. ' + omit)
-            sys.exit()
+            i = int(np.argmin(h_measured))
+            raise InputError('Input value error: h=0 is not allowed. ' + omit,
+                             index=i, value=h_measured[i])
         theta = np.array(theta)
         se = (theta - self.theta_r) / (self.theta_s - self.theta_r)
+        i = int(np.argmax(se))
         if max(se) > 1:
-            print('Input value error: Water content exceeds saturated value.')
-            sys.exit()
+            raise InputError('Input value error: Water content exceeds saturated value.',
+                             index=i, value=theta[i])
         if max(se) == 1:
-            print(
-                'Input value error: Water content at saturated value is not allowed. ' + omit)
-            sys.exit()
+            raise InputError(
+                'Input value error: Water content at saturated value is not allowed. ' + omit,
+                index=i, value=theta[i])
         if min(se) < 0:
-            print('Input value error: Water content is below residual value.')
-            sys.exit()
+            i = int(np.argmin(se))
+            raise InputError('Input value error: Water content is below residual value.',
+                             index=i, value=theta[i])
+        return h_measured, theta
+
+    def initial_hyst(self, h_measured, theta):
+        """Initial values of hysteresis parameters for the optimization"""
+        se = (theta - self.theta_r) / (self.theta_s - self.theta_r)
         hd = self.dry_h(se)
         cos_g = np.where(hd > 0, self.cos_gr * h_measured / hd, self.cos_gr)
         ini_cos_g = min(cos_g)
         ini_b = 0.5
-        ini = ini_cos_g, ini_b
-        a = (h_measured, theta)
-        b = (self.b_cos_g, self.b_b)
-        b = tuple(zip(*b))
-        cos_g0 = self.contact(h_measured[0], theta[0])
-        if cos_g0 > 1:
-            cos_g0 = 1
+        return ini_cos_g, ini_b
 
-        def cost(p, h, theta):
-            return np.log(self.h(p, theta, cont=False) / h)
+    def least_squares(self, cost, ini, jac, args, bounds=None, ftols=None):
+        """Minimize cost with scipy.optimize.least_squares for each of ftols
+
+        bounds of the parameters are self.b_cos_g and self.b_b, and ftols is
+        self.lsq_ftol, when they are None.
+
+        returns result of the last successful optimization
+        """
+        import copy
+        from scipy import optimize
+        if bounds is None:
+            bounds = tuple(zip(self.b_cos_g, self.b_b))
+        b = bounds
         success = False
-        for ftol in self.lsq_ftol:
-            self.cos_g0 = cos_g0
+        for ftol in self.lsq_ftol if ftols is None else ftols:
             result = optimize.least_squares(
-                cost, ini, jac=self.lsq_jac, method=self.lsq_method, loss=self.lsq_loss,
-                ftol=ftol, max_nfev=self.lsq_max_nfev, bounds=b, verbose=self.lsq_verbose, args=a)
+                cost, ini, jac=jac, method=self.lsq_method, loss=self.lsq_loss,
+                ftol=ftol, max_nfev=self.lsq_max_nfev, bounds=b, verbose=self.lsq_verbose, args=args)
             if result.success:
                 ini = result.x
                 success = True
@@ -367,24 +712,15 @@ class Fit(unsatfit.Fit):
                 if success:
                     result = copy.deepcopy(prev_result)
                 break
-        self.success = result.success
-        self.hyst = result.x
-        if not self.success:
-            self.hyst = []
-            self.message = result.message  # Verbal description of the termination reason
-            return
+        return result
 
-        self.cos_g0 = cos_g0
-        # Statistics
-        n = result.fun.size  # sample size
+    def set_statistics(self, h_measured, h_model):
+        """Set statistics of the fitting of hysteresis parameters self.hyst"""
+        n = h_measured.size  # sample size
         k = self.hyst.size  # number of paramteres
         self.mean_h = np.average(h_measured)
         self.var_h = np.average((h_measured - self.mean_h)**2)
-
-        def residual(p, x, y):
-            return self.h(p, x) - y
-        self.mse = np.average(
-            residual(self.hyst, theta, h_measured)**2)
+        self.mse = np.average((h_model - h_measured)**2)
         self.se = math.sqrt(self.mse)  # Standard error
         self.r2 = 1 - self.mse / self.var_h  # Coefficient of determination
         self.aic = n * np.log(self.mse) + 2 * k  # AIC
@@ -392,4 +728,353 @@ class Fit(unsatfit.Fit):
             self.aicc = self.aic + 2 * k * \
                 (k + 1) / (n - k - 1)  # Corrected AIC
         self.message = 'cos(γA) = {0:.3f} b = {1:.2f}'.format(*self.hyst)
+
+    def opt(self, h_measured, theta):
+        """Optimize hysteresis parameters
+
+        input
+
+            h_measured = (h_0, h_1, h_2, ...)
+            theta = (theta_0, theta_1, theta_2, ...)
+
+        returns (cos(gamma_A), b)
+        """
+        h_measured, theta = self.check_data(h_measured, theta)
+        ini = self.initial_hyst(h_measured, theta)
+        a = (h_measured, theta)
+        cos_g0 = self.contact(h_measured[0], theta[0])
+        if cos_g0 > 1:
+            cos_g0 = 1
+
+        sens = self.integrator == 'adaptive' and self.sensitivity
+
+        stats = self.stats
+
+        def cost(p, h, theta):
+            if stats is not None:
+                stats.cost += 1
+            if sens:  # Jacobian at p is cached for jac
+                return np.log(self.h_jac(p, theta, cos_g0)[0] / h)
+            return np.log(self.h(p, theta, cont=False, cos_g0=cos_g0) / h)
+
+        def jac(p, h, theta):
+            if stats is not None:
+                stats.jac += 1
+            h_model, dhdp = self.h_jac(p, theta, cos_g0)
+            return dhdp / h_model[:, None]
+
+        def fit(ini):
+            return self.least_squares(
+                cost, ini, jac if sens else self.lsq_jac, a)
+        with self.phase('opt'):
+            if not self.opt_seeds:
+                result = fit(ini)
+                self.starts = [(ini, result)]
+            else:
+                # Multi-start from the best points of the sample
+                self.starts = []
+                for start in self.seeds(ini, h_measured, theta, cos_g0):
+                    result = fit(start)
+                    same = any(r.success and np.max(np.abs(r.x - result.x)) < self.opt_atol
+                               for _, r in self.starts)
+                    self.starts.append((start, result))
+                    if same and result.success:  # Converged to the same point
+                        break
+                result = min((r for _, r in self.starts),
+                             key=lambda r: (not r.success, r.cost))
+        self.success = result.success
+        self.hyst = result.x
+        if not self.success:
+            self.hyst = []
+            self.message = result.message  # Verbal description of the termination reason
+            return
+
+        # Statistics, where h at the result is cached by h_jac with sensitivity
+        with self.phase('statistics'):
+            if sens:
+                h_model = self.h_jac(self.hyst, theta, cos_g0)[0]
+            else:
+                h_model = self.h(self.hyst, theta, cont=False, cos_g0=cos_g0)
+            self.set_statistics(h_measured, h_model)
         self.cos_g0 = self.contact(h_measured[-1], theta[-1])
+
+    def opt_joint(self, branches, cos_g0=None):
+        """Optimize hysteresis parameters shared by many branches of (h, theta)
+
+        Branches are, for example, wetting and drying scanning curves of a sample or
+        curves of replicate samples of the same soil. All branches are integrated
+        together as lanes of hystfit.CellState. With the Jacobian by sensitivity
+        equations (adaptive integrator and self.sensitivity), each branch is
+        integrated once at each point for both the cost and the Jacobian, as in opt,
+        so that a single branch has the same cost as in opt.
+
+        input
+
+            branches = [(h_measured, theta), ...], each in the order of time
+            cos_g0 : cos of the initial contact angle of each branch, or None to
+                     calculate it from the first point of each branch
+
+        returns (cos(gamma_A), b)
+        """
+        from .cells import CellState
+        data = []
+        for k, (h, theta) in enumerate(branches):
+            try:
+                data.append(self.check_data(h, theta))
+            except InputError as e:
+                raise InputError(f'Branch {k}: {e}', index=(k, e.index),
+                                 value=e.value) from e
+        if cos_g0 is None:
+            cos_g0 = [min(self.contact(h[0], theta[0]), 1)
+                      for h, theta in data]
+        cos_g0 = np.broadcast_to(np.asarray(cos_g0, dtype=float), (len(data),))
+        h_measured = np.concatenate([h for h, _ in data])
+        theta = np.concatenate([t for _, t in data])
+        ini = self.initial_hyst(h_measured, theta)
+        # Water content of the lanes, where a short branch keeps its last value
+        n = max(len(t) for _, t in data)
+        lanes = np.array([np.pad(t, (0, n - len(t)), mode='edge')
+                          for _, t in data])
+        rows = np.concatenate([k * n + np.arange(len(t))
+                               for k, (_, t) in enumerate(data)])
+
+        def h_model(p):
+            cells = CellState(self, p, lanes[:, 0], cos_g0=cos_g0)
+            h = np.empty(lanes.shape)
+            h[:, 0] = cells.h
+            for j in range(1, n):
+                h[:, j] = cells.step(lanes[:, j])
+            return h.ravel()[rows]
+
+        sens = self.integrator == 'adaptive' and self.sensitivity
+        stats = self.stats
+        last = {}  # (h, dh/dp) of the branches at the last p
+
+        def h_jac(p):
+            # Kept for the Jacobian at p, even when the branches do not fit in the
+            # cache of h method
+            key = np.asarray(p, dtype=float).tobytes()
+            if key not in last:
+                last.clear()
+                last[key] = [self.h_jac(p, t, c)
+                             for (_, t), c in zip(data, cos_g0)]
+            return last[key]
+
+        def cost(p):
+            if stats is not None:
+                stats.cost += 1
+            if sens:  # Jacobian at p is kept for jac
+                return np.log(np.concatenate([h for h, _ in h_jac(p)]) / h_measured)
+            return np.log(h_model(p) / h_measured)
+
+        def jac(p):
+            # Rows of each branch depend only on the integration of the branch
+            if stats is not None:
+                stats.jac += 1
+            return np.vstack([dhdp / h[:, None] for h, dhdp in h_jac(p)])
+        with self.phase('opt'):
+            result = self.least_squares(
+                cost, ini, jac if sens else self.lsq_jac, ())
+        self.success = result.success
+        self.hyst = result.x
+        if not self.success:
+            self.hyst = []
+            self.message = result.message  # Verbal description of the termination reason
+            return
+        # Statistics
+        with self.phase('statistics'):
+            self.set_statistics(h_measured, h_model(self.hyst))
+        h, t = data[-1]
+        self.cos_g0 = self.contact(h[-1], t[-1])
+
+    # Confidence intervals
+
+    def refit(self, h_measured, theta, ini, cos_g0, fixed=None):
+        """Optimize hysteresis parameters from ini without statistics
+
+        Used for the refits of the bootstrap and the profile likelihood in confidence.
+        As ini is close to the optimum, only the last of self.lsq_ftol is used.
+
+        input
+
+            h_measured, theta : arrays of the data
+            ini : initial values of (cos(gamma_A), b)
+            cos_g0 : cos of the initial contact angle
+            fixed : (index, value) of the parameter fixed in the optimization, or None
+
+        returns (p, rss, success), where rss is the residual sum of squares of ln(h),
+        and success is False when h cannot be calculated, e.g. at a bound
+        """
+        p = np.array(ini, dtype=float)
+        free = [0, 1]
+        if fixed is not None:
+            p[fixed[0]] = fixed[1]
+            free.remove(fixed[0])
+        sens = self.integrator == 'adaptive' and self.sensitivity
+        stats = self.stats
+
+        def full(x):
+            q = p.copy()
+            q[free] = x
+            return q
+
+        def cost(x, h, theta):
+            if stats is not None:
+                stats.cost += 1
+            if sens:  # Jacobian at x is cached for jac
+                return np.log(self.h_jac(full(x), theta, cos_g0)[0] / h)
+            return np.log(
+                self.h(full(x), theta, cont=False, cos_g0=cos_g0) / h)
+
+        def jac(x, h, theta):
+            if stats is not None:
+                stats.jac += 1
+            h_model, dhdp = self.h_jac(full(x), theta, cos_g0)
+            return dhdp[:, free] / h_model[:, None]
+        b = np.array((self.b_cos_g, self.b_b))[free]
+        try:
+            result = self.least_squares(cost, p[free], jac if sens else self.lsq_jac,
+                                        (h_measured, theta),
+                                        bounds=(b[:, 0], b[:, 1]),
+                                        ftols=self.lsq_ftol[-1:])
+        except NumericalError:
+            return p, math.inf, False
+        return full(result.x), 2 * result.cost, bool(result.success)
+
+    def confidence(self, h_measured, theta, method='bootstrap', level=0.95, n=None,
+                   seed=0, workers=None, executor=None):
+        """Confidence intervals of hysteresis parameters optimized by opt
+
+        Call after opt with the same data. Each refit starts from self.hyst.
+
+        bootstrap: the residuals of ln(h) are resampled n times (default 200) and
+                   the percentile interval of the refitted parameters is taken.
+        profile: each parameter is fixed at n values (default 12) within 4 standard
+                 errors and the other is refitted, and the interval is where the
+                 deviance m ln(RSS / RSS_min) is within the chi-square quantile.
+
+        input
+
+            h_measured, theta : data given to opt
+            method : 'bootstrap' or 'profile'
+            level : confidence level
+            n : number of bootstrap samples or values of a profile
+            seed : seed of the random numbers of the bootstrap
+            workers : number of worker processes (number of CPUs when None).
+                      Refits are calculated in this process when workers is 1.
+            executor : concurrent.futures.Executor used instead of a new process pool
+
+        returns array [[low, high] of cos(gamma_A), [low, high] of b], which is also
+        set to self.ci
+        """
+        h_measured, theta = self.check_data(h_measured, theta)
+        if not self.success:
+            raise InputError('Hysteresis parameters are not optimized.')
+        if method not in ('bootstrap', 'profile'):
+            raise InputError(
+                f'Method {method} of confidence interval is not implemented.', value=method)
+        hyst = np.array(self.hyst, dtype=float)
+        cos_g0 = min(self.contact(h_measured[0], theta[0]), 1)
+        h_model = np.array(self.h(hyst, theta, cont=False, cos_g0=cos_g0))
+        residual = np.log(h_measured / h_model)
+        m = len(h_measured)
+        alpha = (1 - level) / 2
+        with self.phase('confidence'):
+            if method == 'bootstrap':
+                rng = np.random.default_rng(seed)
+                index = rng.integers(0, m, (n or 200, m))
+                tasks = [(h, theta, hyst, cos_g0)
+                         for h in h_model * np.exp(residual[index])]
+                results = self.run_refits(tasks, workers, executor)
+                samples = np.array([p for p, _, success in results if success])
+                self.ci_samples = samples
+                if len(samples):
+                    ci = np.quantile(samples, [alpha, 1 - alpha], axis=0).T
+                else:
+                    ci = np.full((2, 2), np.nan)
+            else:
+                from scipy import stats
+                rss = max(float(np.sum(residual**2)), np.finfo(float).tiny)
+                _, dhdp = self.h_jac(hyst, theta, cos_g0)
+                J = dhdp / h_model[:, None]
+                s2 = rss / max(m - 2, 1)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    se = np.sqrt(np.diag(s2 * np.linalg.pinv(J.T @ J)))
+                bounds = np.array((self.b_cos_g, self.b_b), dtype=float)
+                grids = []
+                for j in range(2):
+                    width = se[j]
+                    if not (np.isfinite(width) and width > 0):
+                        # Grid over the bounds, or around the parameter when the
+                        # bounds are not finite, without the standard error
+                        width = (bounds[j, 1] - bounds[j, 0]) / 8
+                        if not np.isfinite(width):
+                            width = max(abs(hyst[j]), 1) / 4
+                    grid = hyst[j] + 4 * width * np.linspace(-1, 1, n or 12)
+                    grid = np.clip(grid, *bounds[j])
+                    grids.append(np.unique(np.append(grid, hyst[j])))
+                tasks = [(h_measured, theta, hyst, cos_g0, (j, v))
+                         for j in range(2) for v in grids[j]]
+                results = iter(self.run_refits(tasks, workers, executor))
+                threshold = stats.chi2.ppf(level, 1)
+                self.ci_profiles = []
+                ci = np.empty((2, 2))
+                for j in range(2):
+                    deviance = np.array([m * math.log(max(r, rss) / rss) if success
+                                         else np.inf for _, r, success in
+                                         (next(results) for _ in grids[j])])
+                    self.ci_profiles.append((grids[j], deviance))
+                    ci[j] = self.profile_interval(
+                        grids[j], deviance, hyst[j], threshold)
+        self.ci = ci
+        return ci
+
+    @staticmethod
+    def profile_interval(values, deviance, center, threshold):
+        """Interval around center where deviance of the profile is below threshold
+
+        The ends are interpolated linearly between the values, and the end of the
+        values is taken when the deviance does not exceed threshold.
+        """
+        i = int(np.searchsorted(values, center))
+        ends = []
+        for step in (-1, 1):
+            k = i
+            while 0 <= k + \
+                    step < len(values) and deviance[k + step] <= threshold:
+                k += step
+            end = values[k]
+            if 0 <= k + step < len(values):
+                d0, d1 = deviance[k], deviance[k + step]
+                if np.isfinite(d1):
+                    end += (values[k + step] - end) * \
+                        (threshold - d0) / (d1 - d0)
+            ends.append(end)
+        return ends
+
+    def run_refits(self, tasks, workers=None, executor=None):
+        """Calculate refit(*task) for the tasks, in worker processes unless workers is 1
+
+        In each worker, hystfit.Fit with the parameters, including the tabulated
+        drying curve, is built once and reused (see hystfit.batch.refit).
+
+        returns list of the results of refit
+        """
+        if executor is None and workers == 1:
+            return [self.refit(*task) for task in tasks]
+        import concurrent.futures
+        import functools
+        import os
+        from .batch import refit
+        options = {key: value for key, value in vars(self).items()
+                   if key.startswith(('b_', 'lsq_'))}
+        options.update(sensitivity=self.sensitivity, no_warn=self.no_warn)
+        func = functools.partial(refit, self.params(), options)
+        pool = executor or concurrent.futures.ProcessPoolExecutor(workers)
+        chunksize = max(1, len(tasks) //
+                        (4 * (workers or os.cpu_count() or 1)))
+        try:
+            return list(pool.map(func, tasks, chunksize=chunksize))
+        finally:
+            if executor is None:
+                pool.shutdown()
@@ -0,0 +1,384 @@
+"""Kernels of models of the drying curve, which depend only on NumPy."""
+import math
+import sys
+import numpy as np
+
+
+class Kernel:
+    """Base class of kernels of the drying curve
+
+    A kernel gives Se(h), its inverse h(Se), dSe/dh and d2Se/dh2 of a model of the
+    drying curve, where the constants of the functions are calculated from the
+    parameters when the kernel is built. Each function accepts a float, which is
+    calculated with the math module for the integrators advancing one state at a
+    time, or an array.
+
+    input
+
+        params : parameters of the model following theta_s and theta_r, which can
+                 be arrays of the parameters of many cells (see CellState)
+    """
+
+    name = ''  # Name of the model
+    # True when the tabulated drying curve (Model.table_rtol) is faster than the
+    # functions
+    tabulate = False
+
+    def __init__(self, *params):
+        # Parameters which are not arrays are converted to float, which is faster
+        # than numpy scalars in the math module
+        params = tuple(float(v) if np.ndim(v) == 0 else v for v in params)
+        self.params = params
+        # True when the parameters are not arrays and floats are calculated
+        # with the math module
+        self.scalar = all(np.ndim(v) == 0 for v in params)
+
+
+class VanGenuchten(Kernel):
+    """VG model (van Genuchten, 1980) with parameters (alpha, n)"""
+
+    name = 'VG'
+
+    def __init__(self, alpha, n):
+        super(VanGenuchten, self).__init__(alpha, n)
+        alpha, n = self.params
+        self.alpha, self.n = alpha, n
+        self.e_se = 1 / n - 1  # exponent of Se(h)
+        self.e_h = n / (1 - n), 1 / n  # exponents of h(Se)
+        self.k_c = 1 - n  # coefficient of dSe/dh
+        self.e_c = (1 - 2 * n) / n  # exponent of dSe/dh
+        self.k_dc = n - 1, 1 - 2 * n  # coefficients of d2Se/dh2
+
+    def se(self, h):  # Se(h)
+        return (1 + (self.alpha * h)**self.n)**self.e_se
+
+    def h(self, se):  # inverse of Se(h): h(Se)
+        return (se**self.e_h[0] - 1)**self.e_h[1] / self.alpha
+
+    def c(self, h):  # derivative of Se(h): dSe/dh
+        if isinstance(h, (int, float)):
+            if h == 0:
+                return 0
+            u = (self.alpha * h)**self.n
+            return self.k_c / h * (1 + u)**self.e_c * u
+        with np.errstate(divide='ignore', invalid='ignore'):
+            u = (self.alpha * h)**self.n
+            return np.where(h == 0, 0, self.k_c / h * (1 + u)**self.e_c * u)
+
+    def dc(self, h):  # second derivative of Se(h): d2Se/dh2
+        if isinstance(h, (int, float)):
+            if h == 0:
+                return 0
+            u = (self.alpha * h)**self.n
+            return self.k_c / (h * h) * (1 + u)**self.e_c * u * \
+                (self.k_dc[0] + self.k_dc[1] * u / (1 + u))
+        u = (self.alpha * h)**self.n
+        return self.c(h) * (self.k_dc[0] + self.k_dc[1] * u / (1 + u)) / h
+
+    def slope(self, h):
+        """Se and dSe/dln(h) = h dSe/dh, calculated together"""
+        u = (self.alpha * h)**self.n
+        se = (1 + u)**self.e_se
+        return se, self.k_c * se * u / (1 + u)
+
+
+class FredlundXing(Kernel):
+    """FX model (Fredlund and Xing, 1994) with parameters (a, m, n)
+
+    Logarithms and exponentials are calculated with numpy also for floats, which
+    round differently from the math module, so that the results are the same as
+    those of the versions before the kernels.
+    """
+
+    name = 'FX'
+
+    def __init__(self, a, m, n):
+        super(FredlundXing, self).__init__(a, m, n)
+        a, m, n = self.params
+        self.a, self.m, self.n = a, m, n
+        self.e_h = -1 / m, 1 / n  # exponents of h(Se)
+        self.e_c = 1 + 1 / m, n - 1  # exponents of dSe/dh
+        self.k_dc = -(m + 1)  # coefficient of d2Se/dh2
+
+    def se(self, h):  # Se(h)
+        if isinstance(h, (int, float)) and self.scalar:
+            return float(np.log(math.e + (h / self.a)**self.n)**-self.m)
+        return np.log(np.e + (h / self.a)**self.n)**-self.m
+
+    def h(self, se):  # inverse of Se(h): h(Se)
+        if isinstance(se, (int, float)) and self.scalar:
+            if se >= 1:
+                return 0.0
+            if se <= 0:
+                return math.inf
+            x = se**self.e_h[0]
+            if x > LOG_MAX:
+                return math.inf
+            return float(self.a * (np.exp(x) - math.e)**self.e_h[1])
+        # supress RuntimeWarning: invalid value encountered at Se >= 1, where h
+        # = 0
+        with np.errstate(invalid='ignore', over='ignore', divide='ignore'):
+            return np.where(se >= 1, 0, self.a * (np.exp(se**self.e_h[0]) -
+                                                  np.e)**self.e_h[1])
+
+    def c(self, h):  # derivative of Se(h): dSe/dh
+        r = h / self.a
+        return -self.m * self.se(h)**self.e_c[0] * self.n / \
+            self.a * r**self.e_c[1] / (math.e + r**self.n)
+
+    def dc(self, h):  # second derivative of Se(h): d2Se/dh2
+        v = (h / self.a)**self.n
+        dvdh = self.n * v / h
+        log = np.log(math.e + v)
+        if isinstance(h, (int, float)) and self.scalar:
+            log = float(log)
+        return self.c(h) * (self.k_dc * dvdh / ((math.e + v) * log) -
+                            dvdh / (math.e + v) + self.e_c[1] / h)
+
+
+class BrooksCorey(Kernel):
+    """BC model (Brooks and Corey, 1964) with parameters (hb, lambda)
+
+    Se = 1 for h <= hb, so that h(1) = hb, and dSe/dh jumps at h = hb, where the
+    derivative on the dry side is returned so that drying from saturation proceeds.
+    """
+
+    name = 'BC'
+
+    def __init__(self, hb, lam):
+        super(BrooksCorey, self).__init__(hb, lam)
+        hb, lam = self.params
+        self.hb, self.lam = hb, lam
+        self.e_se = -lam  # exponent of Se(h)
+        self.e_h = -1 / lam  # exponent of h(Se)
+        self.k_c, self.e_c = -lam / hb, -lam - 1  # coefficient and exponent of dSe/dh
+        # coefficient and exponent of d2Se/dh2
+        self.k_dc, self.e_dc = lam * (lam + 1) / hb**2, -lam - 2
+
+    def se(self, h):  # Se(h)
+        if isinstance(h, (int, float)) and self.scalar:
+            return 1.0 if h <= self.hb else (h / self.hb)**self.e_se
+        return (np.maximum(h, self.hb) / self.hb)**self.e_se
+
+    def h(self, se):  # inverse of Se(h): h(Se)
+        if isinstance(se, (int, float)) and self.scalar:
+            return math.inf if se <= 0 else self.hb * se**self.e_h
+        with np.errstate(divide='ignore'):
+            return self.hb * se**self.e_h
+
+    def c(self, h):  # derivative of Se(h): dSe/dh
+        if isinstance(h, (int, float)) and self.scalar:
+            return 0.0 if h < self.hb else self.k_c * (h / self.hb)**self.e_c
+        r = np.maximum(h, self.hb) / self.hb
+        return np.where(h >= self.hb, self.k_c * r**self.e_c, 0.0)
+
+    def dc(self, h):  # second derivative of Se(h): d2Se/dh2
+        if isinstance(h, (int, float)) and self.scalar:
+            return 0.0 if h < self.hb else self.k_dc * \
+                (h / self.hb)**self.e_dc
+        r = np.maximum(h, self.hb) / self.hb
+        return np.where(h >= self.hb, self.k_dc * r**self.e_dc, 0.0)
+
+
+class Kosugi(Kernel):
+    """Lognormal model (Kosugi, 1996) with parameters (hm, sigma)
+
+    Se = Q(ln(h / hm) / sigma), where Q is the complementary cumulative normal
+    distribution, and h(Se) is calculated from the inverse of Q (see inverse_q).
+    """
+
+    name = 'KO'
+
+    def __init__(self, hm, sigma):
+        super(Kosugi, self).__init__(hm, sigma)
+        hm, sigma = self.params
+        self.hm, self.sigma = hm, sigma
+        self.k_se = 1 / (sigma * math.sqrt(2))  # coefficient of Se(h)
+        self.k_c = -1 / (sigma * math.sqrt(2 * math.pi)
+                         )  # coefficient of dSe/dh
+        self.log_hm = math.log(hm) if self.scalar else np.log(hm)
+
+    def se(self, h):  # Se(h)
+        if isinstance(h, (int, float)) and self.scalar:
+            if h <= 0:
+                return 1.0
+            return math.erfc((math.log(h) - self.log_hm) * self.k_se) / 2
+        with np.errstate(divide='ignore'):
+            return erfc((np.log(h) - self.log_hm) * self.k_se) / 2
+
+    def h(self, se):  # inverse of Se(h): h(Se)
+        if isinstance(se, (int, float)) and self.scalar:
+            if se >= 1:
+                return 0.0
+            if se <= 0:
+                return math.inf
+            return self.hm * math.exp(self.sigma * inverse_q(se))
+        with np.errstate(over='ignore'):
+            return self.hm * np.exp(self.sigma * inverse_q_array(se))
+
+    def c(self, h):  # derivative of Se(h): dSe/dh
+        if isinstance(h, (int, float)) and self.scalar:
+            if h <= 0:
+                return 0.0
+            z = (math.log(h) - self.log_hm) / self.sigma
+            return self.k_c * math.exp(-z * z / 2) / h
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z = (np.log(h) - self.log_hm) / self.sigma
+            return np.where(h > 0, self.k_c * np.exp(-z * z / 2) / h, 0.0)
+
+    def dc(self, h):  # second derivative of Se(h): d2Se/dh2
+        if isinstance(h, (int, float)) and self.scalar:
+            if h <= 0:
+                return 0.0
+            z = (math.log(h) - self.log_hm) / self.sigma
+            return -self.c(h) * (z / self.sigma + 1) / h
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z = (np.log(h) - self.log_hm) / self.sigma
+            return np.where(h > 0, -self.c(h) * (z / self.sigma + 1) / h, 0.0)
+
+
+class Durner(Kernel):
+    """Bimodal model (Durner, 1994) with parameters (w1, alpha1, n1, alpha2, n2)
+
+    Se = w1 Se1 + (1 - w1) Se2, where Se1 and Se2 are VG models with m = 1 - 1/n.
+    h(Se) lies between h1(Se) and h2(Se) of the two VG models, and it is calculated
+    by Newton's method in ln(h) safeguarded by bisection of this interval.
+    """
+
+    name = 'DV'
+    tabulate = True  # h(Se) is iterative
+
+    def __init__(self, w1, alpha1, n1, alpha2, n2):
+        super(Durner, self).__init__(w1, alpha1, n1, alpha2, n2)
+        w1, alpha1, n1, alpha2, n2 = self.params
+        self.w = w1, 1 - w1  # weights of the two VG models
+        self.vg = VanGenuchten(alpha1, n1), VanGenuchten(alpha2, n2)
+
+    def se(self, h):  # Se(h)
+        return self.w[0] * self.vg[0].se(h) + self.w[1] * self.vg[1].se(h)
+
+    def slope(self, h):
+        """Se and dSe/dln(h) = h dSe/dh, calculated together"""
+        (s1, d1), (s2, d2) = self.vg[0].slope(h), self.vg[1].slope(h)
+        return self.w[0] * s1 + self.w[1] * s2, self.w[0] * d1 + self.w[1] * d2
+
+    def h(self, se):  # inverse of Se(h): h(Se)
+        if isinstance(se, (int, float)) and self.scalar:
+            if se >= 1:
+                return 0.0
+            if se <= 0:
+                return math.inf
+            h1, h2 = self.vg[0].h(se), self.vg[1].h(se)
+            lo, hi = math.log(min(h1, h2)), math.log(max(h1, h2))
+            z = (lo + hi) / 2
+            for i in range(100):
+                f, d = self.slope(math.exp(z))
+                f -= se
+                if f > 0:
+                    lo = z
+                else:
+                    hi = z
+                dz = -f / d
+                if abs(dz) <= 1e-12 * max(1, abs(z)):
+                    return math.exp(z + dz)
+                z += dz
+                if not lo < z < hi:
+                    z = (lo + hi) / 2
+            return math.exp(z)
+        se = np.asarray(se, dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            inside = (se > 0) & (se < 1)
+            s = np.where(inside, se, 0.5)
+            h1, h2 = self.vg[0].h(s), self.vg[1].h(s)
+            lo, hi = np.log(np.minimum(h1, h2)), np.log(np.maximum(h1, h2))
+            z = (lo + hi) / 2
+            for i in range(100):
+                f, d = self.slope(np.exp(z))
+                f = f - s
+                lo, hi = np.where(f > 0, z, lo), np.where(f > 0, hi, z)
+                dz = -f / d
+                done = np.abs(dz) <= 1e-12 * np.maximum(1, np.abs(z))
+                z = z + dz
+                z = np.where(done | (z > lo) & (z < hi), z, (lo + hi) / 2)
+                if done.all():
+                    break
+            return np.where(inside, np.exp(z), np.where(se >= 1, 0, np.where(
+                se <= 0, np.inf, np.nan)))
+
+    def c(self, h):  # derivative of Se(h): dSe/dh
+        return self.w[0] * self.vg[0].c(h) + self.w[1] * self.vg[1].c(h)
+
+    def dc(self, h):  # second derivative of Se(h): d2Se/dh2
+        return self.w[0] * self.vg[0].dc(h) + self.w[1] * self.vg[1].dc(h)
+
+
+# Largest x of exp(x) without overflow
+LOG_MAX = math.log(sys.float_info.max)
+
+# Kernels by the name of the model, which is also the name in unsatfit
+KERNELS = {k.name: k for k in (VanGenuchten, FredlundXing, BrooksCorey, Kosugi,
+                               Durner)}
+
+# Coefficients of the rational approximation of the inverse of the cumulative
+# normal distribution by P. J. Acklam, whose relative error is below 1.2e-9
+ACKLAM_A = (-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02,
+            1.383577518672690e+02, -3.066479806614716e+01, 2.506628277459239e+00)
+ACKLAM_B = (-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02,
+            6.680131188771972e+01, -1.328068155288572e+01, 1)
+ACKLAM_C = (-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00,
+            -2.549732539343734e+00, 4.374664141464968e+00, 2.938163982698783e+00)
+ACKLAM_D = (7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00,
+            3.754408661907416e+00, 1)
+ACKLAM_LOW = 0.02425  # Se below which the tail approximation is used
+
+
+ERFC = np.frompyfunc(math.erfc, 1, 1)  # math.erfc applied to each element
+
+
+def erfc(x):
+    """Complementary error function of an array, which is not in NumPy"""
+    return np.asarray(ERFC(x), dtype=float)
+
+
+def polynomial(coef, x):
+    """Polynomial of x with coefficients from the highest degree"""
+    y = coef[0]
+    for c in coef[1:]:
+        y = y * x + c
+    return y
+
+
+def inverse_q(q):
+    """x of Q(x) = q for 0 < q < 1, where Q(x) = erfc(x / sqrt(2)) / 2
+
+    The approximation of Acklam is refined by a step of Halley's method to the
+    precision of math.erfc.
+    """
+    if q < ACKLAM_LOW:
+        t = math.sqrt(-2 * math.log(q))
+        x = -polynomial(ACKLAM_C, t) / polynomial(ACKLAM_D, t)
+    elif q > 1 - ACKLAM_LOW:
+        t = math.sqrt(-2 * math.log1p(-q))
+        x = polynomial(ACKLAM_C, t) / polynomial(ACKLAM_D, t)
+    else:
+        t = q - 0.5
+        x = -t * polynomial(ACKLAM_A, t * t) / polynomial(ACKLAM_B, t * t)
+    u = (q - math.erfc(x / math.sqrt(2)) / 2) * \
+        math.sqrt(2 * math.pi) * math.exp(x * x / 2)
+    return x - u / (1 + x * u / 2)
+
+
+def inverse_q_array(q):
+    """inverse_q of an array, where inf, -inf or nan is given outside of 0 < q < 1"""
+    q = np.asarray(q, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        t = np.sqrt(-2 * np.log(np.minimum(q, 1 - q)))
+        tail = polynomial(ACKLAM_C, t) / polynomial(ACKLAM_D, t)
+        m = q - 0.5
+        x = np.where(q < ACKLAM_LOW, -tail, np.where(q > 1 - ACKLAM_LOW, tail,
+                     -m * polynomial(ACKLAM_A, m * m) / polynomial(ACKLAM_B, m * m)))
+        x = np.where((q > 0) & (q < 1), x, 0)
+        u = (q - erfc(x / math.sqrt(2)) / 2) * \
+            math.sqrt(2 * math.pi) * np.exp(x * x / 2)
+        x = x - u / (1 + x * u / 2)
+        return np.where(q <= 0, np.inf, np.where(q >= 1, -np.inf, x))
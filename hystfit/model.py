@@ -0,0 +1,1139 @@
+"""Hysteresis model with a known drying curve, which depends only on NumPy."""
+import math
+import numpy as np
+from .errors import InputError, ModelNotSupported, NumericalError
+
+
+class Model:
+    """hystfit.Model - Hysteresis of soil water retention with a known drying curve
+
+    Implementation of Zhao model for calculating h from changes in water content
+    with given parameters of the drying curve and hysteresis. hystfit.Fit is a
+    subclass which fits the parameters with unsatfit.
+
+    Zhao, A. (2013) A contact angle-dependent hysteresis model for soil–water retention behaviour,
+         Computers and Geotechnics 49: 36-42. https://doi.org/10.1016/j.compgeo.2012.10.004
+    """
+
+    # Initialization
+
+    def __init__(self):
+        super(Model, self).__init__()
+        self.debug = False
+        self.no_warn = False
+        # cos(gamma_R), where gamma_R is the receding contact angle
+        self.cos_gr = 1
+        # cos(gamma_0), where gamma_0 is the initial contact angle
+        self.cos_g0 = 1
+        self.delta_theta = 0.0001  # step of calculation of d_theta
+        self.delta_h = 1  # step of calculation of d_h when dSe/dt is small
+        # Integrator of h method: 'legacy' (fixed step of delta_theta) or
+        # 'adaptive'
+        self.integrator = 'legacy'
+        self.rtol = 1e-5  # relative tolerance of h in the adaptive integrator
+        self.atol = 1e-3  # absolute tolerance of h in the adaptive integrator
+        self.max_step = 100000  # maximum number of steps of the adaptive integrator
+        # Maximum spacing of dense output along the arc length in (Se, ln h)
+        self.dense_step = 0.01
+        self.trace = None  # States recorded for dense output
+        self.cache_size = 64  # Maximum number of results of h method in the cache
+        self.cache_hits = 0  # Number of results of h method taken from the cache
+        self.cache_misses = 0  # Number of results of h method calculated
+        self.clear_cache()
+        # Performance counters (hystfit.Stats), or None when not recorded
+        self.stats = None
+        self.dry_se = lambda h: False  # Mark that drying curve is not set
+        # Relative tolerance of tabulated drying curve, or None for exact
+        # functions, which are used also for the kernels without tabulate
+        self.table_rtol = None
+        self.table = None  # Table of drying curve
+        self.table_key = None  # Parameters of the table
+        self.kernel = None  # Kernel of the drying curve (see hystfit.kernels)
+        # Model of the drying curve: 'VG', 'FX', 'BC', 'KO' or 'DV'
+        self.dry_model = None
+        self.hyst = []  # Hysteresis parameters (cos(gamma_A), b)
+        self.max_se = 1  # Maximum Se
+        # Settings of the integrators saved by the params method
+        self.settings = ('integrator', 'delta_theta', 'delta_h', 'rtol', 'atol',
+                         'max_step', 'max_se', 'table_rtol')
+
+    # Drying curve
+
+    def set_drying_curve(self, model, theta_s, theta_r, *params):
+        """Set the main drying curve
+
+        input
+
+            model : name of the model, 'VG', 'FX', 'BC', 'KO' or 'DV' (see
+                    hystfit.kernels)
+            theta_s, theta_r : saturated and residual water content
+            params : parameters of the model, e.g. (alpha, n) of VG
+
+        The contact angle is reset to self.cos_g0 = 1.
+        """
+        from .kernels import KERNELS
+        if model not in KERNELS:
+            raise ModelNotSupported(
+                f'Model name {model} is not implemented in hystfit.', value=model)
+        self.theta_s = theta_s
+        self.theta_r = theta_r
+        self.cos_g0 = 1
+        self.set_kernel(KERNELS[model](*params))
+
+    def set_kernel(self, kernel):
+        """Set the functions of the drying curve from a kernel (see hystfit.kernels)"""
+        self.kernel = kernel
+        self.dry_model = kernel.name
+        self.dry_se = kernel.se  # Se(h)
+        self.dry_h = kernel.h  # h(Se)
+        self.dry_c = kernel.c  # dSe/dh
+        self.dry_dc = kernel.dc  # d2Se/dh2
+        self.clear_cache()
+        self.table = None
+        self.set_table()
+
+    @property
+    def swrf_p(self):
+        """Parameters of the drying curve, which rebuild the kernel when they are set"""
+        return self.kernel.params
+
+    @swrf_p.setter
+    def swrf_p(self, params):
+        self.set_kernel(type(self.kernel)(*params))
+
+    def set_vg(self, theta_s, theta_r, alpha, n):
+        """Set VG model (van Genuchten, 1980)"""
+        self.set_drying_curve('VG', theta_s, theta_r, alpha, n)
+
+    def set_fx(self, theta_s, theta_r, a, m, n):
+        """Set FX model (Fredlund and Xing, 1994)"""
+        self.set_drying_curve('FX', theta_s, theta_r, a, m, n)
+
+    def set_bc(self, theta_s, theta_r, hb, lam):
+        """Set BC model (Brooks and Corey, 1964), where lam is lambda"""
+        self.set_drying_curve('BC', theta_s, theta_r, hb, lam)
+
+    def set_ko(self, theta_s, theta_r, hm, sigma):
+        """Set lognormal model (Kosugi, 1996)"""
+        self.set_drying_curve('KO', theta_s, theta_r, hm, sigma)
+
+    def set_dv(self, theta_s, theta_r, w1, alpha1, n1, alpha2, n2):
+        """Set bimodal VG model (Durner, 1994)"""
+        self.set_drying_curve(
+            'DV',
+            theta_s,
+            theta_r,
+            w1,
+            alpha1,
+            n1,
+            alpha2,
+            n2)
+
+    # Functions of the drying curve of the versions before hystfit.kernels, which
+    # are those of self.kernel set by set_vg or set_fx
+
+    def vg_seh(self, h):  # Se(h)
+        return self.kernel.se(h)
+
+    def vg_h(self, se):  # inverse of Se(h): h(Se)
+        return self.kernel.h(se)
+
+    def vg_c(self, h):  # derivative of Se(h): dSe/dh
+        return self.kernel.c(h)
+
+    def vg_dc(self, h):  # second derivative of Se(h): d2Se/dh2
+        return self.kernel.dc(h)
+
+    fx_seh, fx_h, fx_c, fx_dc = vg_seh, vg_h, vg_c, vg_dc
+
+    # Parameters
+
+    def params(self):
+        """Dictionary of the parameters, which can be saved as JSON
+
+        The model and parameters of the drying curve, cos(gamma_R), the hysteresis
+        parameters self.hyst, the current contact angle self.cos_g0 and the settings
+        of the integrators are included.
+        """
+        return {'model': self.dry_model,
+                'theta_s': float(self.theta_s),
+                'theta_r': float(self.theta_r),
+                'swrf_p': [float(v) for v in self.swrf_p],
+                'cos_gr': float(self.cos_gr),
+                'hyst': [float(v) for v in self.hyst],
+                'cos_g0': float(self.cos_g0),
+                'settings': {key: getattr(self, key) for key in self.settings}}
+
+    def set_params(self, params):
+        """Set the parameters given by the params method"""
+        self.set_drying_curve(params['model'], params['theta_s'], params['theta_r'],
+                              *params['swrf_p'])
+        self.cos_gr = params['cos_gr']
+        self.hyst = list(params['hyst'])
+        self.cos_g0 = params['cos_g0']
+        for key, value in params.get('settings', {}).items():
+            if key in self.settings:
+                setattr(self, key, value)
+
+    # Tabulated drying curve
+
+    def set_table(self, nodes=None):
+        """Tabulate the drying curve when self.table_rtol is set
+
+        Se(h), h(Se) and dSe/dh of the drying curve are replaced by the lookup of
+        the table, which is rebuilt when self.swrf_p or self.table_rtol is changed.
+        The exact functions are restored when self.table_rtol is None, and they are
+        kept for the kernels whose functions are faster than the lookup (see
+        Kernel.tabulate). nodes of a table built before with the same parameters can
+        be given (see Table).
+        """
+        key = (self.swrf_p, self.table_rtol)
+        if self.table is not None:
+            if self.table_key == key:
+                return
+            self.dry_se = self.table.f_se
+            self.dry_h = self.table.f_h
+            self.dry_c = self.table.f_c
+            self.table = None
+        if self.table_rtol is None or not self.kernel.tabulate:
+            return
+        from .table import Table
+        self.table = Table(self.dry_se, self.dry_h, self.dry_c,
+                           self.dry_dc, rtol=self.table_rtol, nodes=nodes)
+        self.table_key = key
+        self.dry_se = self.table.se
+        self.dry_h = self.table.h
+        self.dry_c = self.table.c_h
+
+    # Calculate dh from h, theta, d_theta, (cos_ga, b)
+
+    def dsedh(self, h, theta, d_theta, p):  # dSe/dh
+        if self.stats is not None:
+            self.stats.dsedh += 1
+        if h == 0:
+            return 0
+        cos_ga, b = p  # hysteresis parameters: cos(theta_A) and b
+        # Calculate hd = h at drying curve
+        se = (theta - self.theta_r) / (self.theta_s - self.theta_r)
+        # Fix Se > max_se
+        if se > self.max_se:
+            se = self.max_se
+        hd = self.dry_h(se)
+        if math.isnan(hd):
+            raise NumericalError(
+                f'Error: h was not calculated at Se = {se}', value=se)
+        # Calculate cos_g = cos(theta)
+        if hd == 0:
+            cos_g = self.cos_gr
+        else:
+            cos_g = self.cos_gr * h / hd
+        # Calculate k of eq. 11 in Zhao (2013)
+        if d_theta < 0:  # when ds<0
+            k = cos_g - self.cos_gr
+        else:  # when ds>0
+            k = cos_ga - cos_g
+        k = k / (cos_ga - self.cos_gr)
+        if k < 0:
+            k = 0
+        if k > 1:
+            k = 1
+        k = k ** b
+        # Calculate dsedh = dSe/dh
+        dsedh = self.dry_c(hd)
+        if math.isnan(dsedh):
+            raise NumericalError(
+                f'Error: dSe/dh was not calculated at h = {hd}', value=hd)
+        dsedh *= hd / h * (1 - k)
+        return dsedh
+
+    def h(self, p, x, cont=True, cos_g0=None):
+        """Calculate hysteresis
+
+        input
+
+            p = (cos(theta_A), b)
+            x = (theta_0, theta_1, theta_2, ...)
+            cont : if True, the last contact angle is remembered for the next initial value
+            cos_g0 : cos of the initial contact angle, or None to use self.cos_g0
+
+            self.cos_g0 : cos of the initial contact angle
+            self.integrator : 'legacy' or 'adaptive'
+
+        returns (h1, h2, ...)
+        """
+        if cos_g0 is None:
+            cos_g0 = self.cos_g0
+        assert not math.isnan(cos_g0)
+        self.check_theta(x)
+        key = self.cache_key(p, x, cos_g0)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            self.cache_hits += 1
+            ret = list(self.cache[key])
+        else:
+            if self.integrator == 'adaptive':
+                ret = self.h_adaptive(p, x, cos_g0)
+            else:
+                ret = self.h_legacy(p, x, cos_g0)
+            if key is not None:
+                self.cache_misses += 1
+                self.cache[key] = tuple(ret)
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        if cont:
+            self.cos_g0 = self.contact(ret[-1], x[-1])
+            assert self.cos_g0 >= 0
+        return ret
+
+    def cache_key(self, p, x, cos_g0):
+        """Key of the cache of h method, or None when the result is not cached
+
+        The key consists of p, x, cos_g0, the drying curve and the settings of the
+        integrators. Results are not cached while dense output is recorded or when
+        the parameters are arrays.
+        """
+        if not self.cache_size or self.trace is not None:
+            return None
+        key = (tuple(float(v) for v in p), np.asarray(x, dtype=float).tobytes(),
+               float(
+            cos_g0), self.dry_model, self.swrf_p, self.theta_s, self.theta_r, self.cos_gr,
+            self.max_se, self.integrator, self.delta_theta, self.delta_h, self.rtol,
+            self.atol, self.max_step, self.table_rtol)
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def evaluate(self, p, x, cos_g0):
+        """Calculate hysteresis without changing the object
+
+        Reentrant version of h method, so that one object can be shared by threads.
+        The initial contact angle is given and the last one is returned instead of
+        self.cos_g0, and the cache of h method is not used. The drying curve and the
+        settings must not be changed while other threads calculate, and self.stats
+        should be None, as the counters are not updated atomically.
+
+        input
+
+            p = (cos(theta_A), b)
+            x = (theta_0, theta_1, theta_2, ...)
+            cos_g0 : cos of the initial contact angle
+
+        returns (h, cos_g), where h is array of h and cos_g is cos of the last contact angle
+        """
+        assert not math.isnan(cos_g0)
+        self.check_theta(x)
+        if self.integrator == 'adaptive':
+            h = self.h_adaptive(p, x, cos_g0)
+        else:
+            h = self.h_legacy(p, x, cos_g0)
+        return np.array(h), self.contact(h[-1], x[-1])
+
+    def clear_cache(self):
+        """Clear the cache of h method"""
+        import collections
+        self.cache = collections.OrderedDict()
+
+    def check_theta(self, x):
+        """Check the drying curve and range of water content before calculating h"""
+        self.prepare()
+        if max(x) > self.theta_s * self.max_se and not self.no_warn:
+            print(
+                f'Effective saturation exceeding {self.max_se} is fixed to {self.max_se}.')
+        if min(x) < self.theta_r:
+            i = int(np.argmin(x))
+            raise InputError(
+                'Water content below residual value is found.', index=i, value=x[i])
+
+    def prepare(self):
+        """Check the drying curve and prepare its table and counters of calls"""
+        assert self.dry_se(0), print(
+            'Drying curve not set. Use set_drying_curve, set_vg or set_fx')
+        self.count_calls(None)
+        self.set_table()
+        self.count_calls(self.stats)
+
+    def count_calls(self, stats):
+        """Count calls of h(Se) and dSe/dh of the drying curve in stats
+
+        The counters of the last call are removed, and nothing is counted when stats
+        is None.
+        """
+        for name in ('dry_h', 'dry_c'):
+            func = getattr(self, name)
+            if hasattr(func, 'wrapped'):
+                func = func.wrapped
+            elif stats is None:
+                continue
+            if stats is not None:
+                func = stats.counter(name, func)
+            setattr(self, name, func)
+
+    def phase(self, name):
+        """Context manager measuring the wall time of a phase in self.stats"""
+        import contextlib
+        if self.stats is None:
+            return contextlib.nullcontext()
+        return self.stats.phase(name)
+
+    def h_legacy(self, p, x, cos_g0):
+        """Calculate hysteresis with fixed step of self.delta_theta"""
+        theta = x[0]
+        h = self.dry_h((theta - self.theta_r) /
+                       (self.theta_s - self.theta_r)) * cos_g0 / self.cos_gr
+        ret = [h]
+        if self.stats is not None:
+            self.stats.h += 1
+        if self.trace is not None:
+            self.trace.append(
+                ((theta - self.theta_r) / (self.theta_s - self.theta_r), h, True))
+        for t in x[1:]:
+            h, theta = self.h_legacy_segment(h, theta, t, p)
+            ret.append(h)
+        return ret
+
+    def h_legacy_segment(self, h, theta, t, p):
+        """Integrate h from theta to t with fixed step and return (h, theta)"""
+        def se(theta):
+            return (theta - self.theta_r) / (self.theta_s - self.theta_r)
+        trace = self.trace
+        stats = self.stats
+        if stats is not None:
+            steps = stats.steps
+        max_t = self.max_se * (self.theta_s - self.theta_r) + self.theta_r
+        if t > max_t:
+            t = max_t
+        while t != theta:
+            dt = t - theta
+            if self.dry_se(
+                    h) * self.max_se < se(theta) and dt < 0 or h == 0:
+                h_jump = self.dry_h(se(theta))
+                if trace is not None and h_jump != h:
+                    trace.append((se(theta), h_jump, False))
+                h = h_jump
+                theta = t
+                if stats is not None:
+                    stats.jumps += 1
+                continue
+            if abs(dt) > self.delta_theta:
+                dt = self.delta_theta * dt / abs(dt)
+            dse = dt / (self.theta_s - self.theta_r)
+            dsedh = self.dsedh(h, theta, dt, p)
+            if abs(dse) < self.delta_h * abs(dsedh):
+                dh = dse / dsedh
+            else:
+                dh = -self.delta_h * dt / abs(dt)
+                dse = dh * dsedh
+                dt = dse * (self.theta_s - self.theta_r)
+                if stats is not None:
+                    stats.delta_h += 1
+            h += dh
+            if h < 0:
+                h = 0
+            theta += dt
+            if h > self.dry_h(se(theta)):
+                h = self.dry_h(se(theta))
+                if stats is not None:
+                    stats.clamps += 1
+            if stats is not None:
+                stats.steps += 1
+            if trace is not None and theta != t:
+                trace.append((se(theta), h, False))
+        if trace is not None:
+            trace.append((se(t), h + 0, True))
+        if stats is not None:
+            stats.segments += 1
+            stats.segment_steps[stats.steps - steps] += 1
+        return h + 0, theta
+
+    # Adaptive integrator
+
+    def arc(self, se, h, sign, p):
+        """Tangent (dSe/ds, dh/ds) of the curve, where s is the arc length in the (Se, ln h) plane"""
+        if h < 0:
+            h = 0
+        theta = se * (self.theta_s - self.theta_r) + self.theta_r
+        dsedh = self.dsedh(h, theta, sign, p)
+        g = -sign / math.sqrt(dsedh**2 + (h + self.atol)**-2)
+        return g * dsedh, g
+
+    def arc_sens(self, y, s_h, sign, p):
+        """Tangent of arc and forward sensitivity equations
+
+        y = (Se, h, dSe/dcos_ga, dSe/db) along the arc, and s_h = (dh/dcos_ga, dh/db)
+        is constant in a segment. Any component parallel to the tangent, such as the
+        derivative of the length scale of the arc, is removed at the end of the segment.
+        """
+        h = y[1] if y[1] > 0 else 0
+        dsedh, d_se, d_h, (d_a, d_b) = self.dsedh_partial(h, y[0], sign, p)
+        g = -sign / math.sqrt(dsedh * dsedh + (h + self.atol)**-2)
+        return [g * dsedh, g, g * (d_se * y[2] + d_h * s_h[0] + d_a),
+                g * (d_se * y[3] + d_h * s_h[1] + d_b)]
+
+    def dsedh_partial(self, h, se, sign, p):
+        """dSe/dh and its partial derivatives
+
+        returns (dSe/dh, d(dSe/dh)/dSe, d(dSe/dh)/dh, (d(dSe/dh)/dcos_ga, d(dSe/dh)/db))
+        """
+        if self.stats is not None:
+            self.stats.dsedh += 1
+        cos_ga, b = p
+        cos_gr = self.cos_gr
+        if se > self.max_se:
+            se = self.max_se
+        hd = self.dry_h(se)
+        if h <= 0 or hd <= 0:
+            return 0, 0, 0, (0, 0)
+        c = self.dry_c(hd)
+        # dhd/dSe, where hd is constant at Se >= max_se
+        dhdse = 1 / c if se < self.max_se else 0
+        cos_g = cos_gr * h / hd
+        if sign < 0:
+            u = (cos_g - cos_gr) / (cos_ga - cos_gr)
+            dudg = 1 / (cos_ga - cos_gr)
+        else:
+            u = (cos_ga - cos_g) / (cos_ga - cos_gr)
+            dudg = -1 / (cos_ga - cos_gr)
+        duda = sign * (cos_g - cos_gr) / (cos_ga - cos_gr)**2
+        # k = u**b with u clamped to [0, 1] as in dsedh, where 0**0 = 1
+        if u <= 0:
+            k, dkdu, dkdb = 0.0**b, 0.0, 0.0
+        elif u >= 1:
+            k, dkdu, dkdb = 1.0, 0.0, 0.0
+        else:
+            k = u**b
+            dkdu = b * k / u
+            dkdb = k * math.log(u)
+        a = c * hd / h
+        dsedh = a * (1 - k)
+        d_h = -a / h * (1 - k) - a * dkdu * dudg * cos_gr / hd
+        d_se = dhdse * (self.dry_dc(hd) * hd + c) / h * (1 - k) + \
+            a * dkdu * dudg * cos_gr * h * dhdse / hd**2
+        return dsedh, d_se, d_h, (-a * dkdu * duda, -a * dkdb)
+
+    def h_adaptive(self, p, x, cos_g0, sens=False):
+        """Calculate hysteresis with adaptive step size
+
+        The curve is integrated along its arc length in the (Se, ln h) plane with the
+        embedded Runge-Kutta pair of Bogacki and Shampine (1989), so that the steep part
+        after a reversal point needs no special treatment. The step size is controlled by
+        the error of h (self.rtol and self.atol) and Se (self.rtol).
+
+        When sens is True, (h, dh/dp) is returned, where dh/dp is calculated by
+        forward sensitivity equations integrated alongside h.
+        """
+        se_x = [(t - self.theta_r) / (self.theta_s - self.theta_r) for t in x]
+        se = se_x[0]
+        h = float(self.dry_h(se) * cos_g0 / self.cos_gr)
+        ret = [h]
+        s_h = [0.0, 0.0] if sens else None
+        jac = [s_h]
+        step = 0.01
+        if self.stats is not None:
+            self.stats.h += 1
+        if self.trace is not None:
+            self.trace.append((se, h, True))
+        for target in se_x[1:]:
+            if target > self.max_se:
+                target = self.max_se
+            if target != se:
+                h, step, s_h = self.h_segment(h, se, target, p, step, s_h)
+                se = target
+            ret.append(h)
+            jac.append(s_h)
+            if self.trace is not None:
+                self.trace.append((se, h, True))
+        if sens:
+            return ret, jac
+        return ret
+
+    def h_segment(self, h, se, target, p, step, s_h=None):
+        """Integrate h from se to target and return (h, next step size, dh/dp)
+
+        s_h is dh/dp at se, or None when the sensitivity is not calculated.
+        """
+        sign = 1 if target > se else -1
+        stats = self.stats
+        if stats is not None:
+            stats.segments += 1
+            steps = stats.steps
+        # Drying from the main drying curve or from h = 0 follows the main
+        # drying curve
+        if h <= 0 or sign < 0 and h >= self.dry_h(min(se, self.max_se)):
+            if self.trace is not None:
+                self.trace_drying(se, target)
+            if stats is not None:
+                stats.jumps += 1
+                stats.segment_steps[0] += 1
+            return float(self.dry_h(target)), step, s_h and [0.0, 0.0]
+        if s_h is None:
+            y = [se, h]
+
+            def f(y):
+                return self.arc(y[0], y[1], sign, p)
+        else:
+            y = [se, h, 0.0, 0.0]
+            s_h = list(s_h)
+
+            def f(y):
+                return self.arc_sens(y, s_h, sign, p)
+        n = len(y)
+        k1 = f(y)
+        wetting = False  # on the main wetting curve
+        for _ in range(self.max_step):
+            k2 = f([y[i] + step / 2 * k1[i] for i in range(n)])
+            k3 = f([y[i] + step * 3 / 4 * k2[i] for i in range(n)])
+            y_new = [y[i] + step * (2 / 9 * k1[i] + 1 / 3 * k2[i] + 4 / 9 * k3[i])
+                     for i in range(n)]
+            k4 = f(y_new)
+            e_se, e_h = [step * (-5 / 72 * k1[i] + 1 / 12 * k2[i] + 1 / 9 * k3[i] - 1 / 8 * k4[i])
+                         for i in range(2)]
+            err = max(abs(e_se) / self.rtol, abs(e_h) /
+                      (self.atol + self.rtol * max(abs(y[1]), abs(y_new[1]))))
+            if err > 1:  # Reject the step
+                step *= max(0.2, 0.9 * err**(-1 / 3))
+                if stats is not None:
+                    stats.rejected += 1
+                continue
+            over = sign * (y_new[0] - target)
+            if over > 1e-12:  # Shorten the step to land on the target
+                step *= (target - y[0]) / (y_new[0] - y[0])
+                if stats is not None:
+                    stats.rejected += 1
+                continue
+            if self.trace is not None:
+                self.trace_step(y, y_new, k1, k4, step)
+            step *= min(5, 0.9 * err**(-1 / 3)) if err > 0 else 5
+            y, k1 = y_new, k4
+            if stats is not None:
+                stats.steps += 1
+            hd = self.dry_h(min(y[0], self.max_se))
+            if y[1] <= 0 or sign < 0 and y[1] >= hd:
+                if self.trace is not None:
+                    self.trace_drying(y[0], target)
+                if stats is not None:
+                    stats.jumps += 1
+                    stats.segment_steps[stats.steps - steps] += 1
+                return float(self.dry_h(target)), step, s_h and [0.0, 0.0]
+            if y[1] > hd:
+                y[1] = hd
+                if stats is not None:
+                    stats.clamps += 1
+                if s_h is not None:  # h = hd(Se) on the main drying curve
+                    s_h[:] = [y[2 + i] / self.dry_c(hd) for i in range(2)]
+                k1 = f(y)
+            elif s_h is not None and sign > 0 and not wetting and \
+                    y[1] * self.cos_gr <= p[0] * hd:
+                # h = cos_ga * hd(Se) / cos_gr on the main wetting curve, which the
+                # sensitivity equations cannot follow because dSe/dh is not
+                # smooth
+                wetting = True
+                s_h[:] = [hd / self.cos_gr, 0.0]
+                y[2:] = [0.0, 0.0]
+                k1 = f(y)
+            if self.trace is not None and over <= -1e-12:
+                self.trace.append((y[0], y[1], False))
+            if over > -1e-12:
+                if s_h is not None:  # dh/dp at Se = target
+                    dsedh = self.dsedh_partial(y[1], target, sign, p)[0]
+                    if dsedh != 0:
+                        s_h = [s_h[i] - y[2 + i] / dsedh for i in range(2)]
+                if stats is not None:
+                    stats.segment_steps[stats.steps - steps] += 1
+                return float(y[1]), step, s_h
+        raise NumericalError(
+            'Error: maximum number of steps exceeded in the adaptive integrator.', value=(se, target))
+
+    def h_jac(self, p, x, cos_g0=None):
+        """Calculate hysteresis and its Jacobian with the adaptive integrator
+
+        input is the same as h method, and self.cos_g0 is not changed. The result
+        is cached, so that the cost and the Jacobian at the same p in an
+        optimization are integrated only once when both are taken from h_jac. h
+        is not cached for h method, from which it differs by rounding errors.
+
+        returns (h, dh/dp) as arrays of shape (len(x),) and (len(x), 2)
+        """
+        if cos_g0 is None:
+            cos_g0 = self.cos_g0
+        assert not math.isnan(cos_g0)
+        self.check_theta(x)
+        integrator = self.integrator
+        self.integrator = 'adaptive'  # Key of h by the adaptive integrator
+        key = self.cache_key(p, x, cos_g0)
+        self.integrator = integrator
+        if key is not None and (key, 'jac') in self.cache:
+            self.cache.move_to_end((key, 'jac'))
+            self.cache_hits += 1
+            h, jac = self.cache[key, 'jac']
+        else:
+            h, jac = self.h_adaptive(p, x, cos_g0, sens=True)
+            if key is not None:
+                self.cache_misses += 1
+                self.cache[key, 'jac'] = (tuple(h), tuple(map(tuple, jac)))
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        return np.array(h), np.array(jac)
+
+    # Water content from h
+
+    def theta(self, p, h_path, cont=True, cos_g0=None):
+        """Calculate hysteresis of water content from a history of h
+
+        Inverse of h method, where dSe/dh of eq. 11 in Zhao (2013) is integrated with
+        ln(h + self.atol) as the independent variable by the embedded Runge-Kutta pair
+        of the adaptive integrator, regardless of self.integrator. Increase of h is
+        drying and decrease is wetting. Se is clamped to the main drying curve and
+        self.max_se, and drying from the main drying curve follows it. The error of Se
+        in a step is controlled by self.rtol.
+
+        input
+
+            p = (cos(theta_A), b)
+            h_path = (h_0, h_1, h_2, ...)
+            cont : if True, the last contact angle is remembered for the next initial value
+            cos_g0 : cos of the initial contact angle, or None to use self.cos_g0
+
+        returns array of (theta_0, theta_1, theta_2, ...)
+        """
+        if cos_g0 is None:
+            cos_g0 = self.cos_g0
+        assert not math.isnan(cos_g0)
+        self.prepare()
+        h_path = np.asarray(h_path, dtype=float)
+        if min(h_path) < 0:
+            i = int(np.argmin(h_path))
+            raise InputError('Input value error: h<0 is not allowed.',
+                             index=i, value=h_path[i])
+        # Initial state on the curve of h = cos_g0 / cos_gr * hd(Se)
+        h = float(h_path[0])
+        hd = h * self.cos_gr / cos_g0 if cos_g0 > 0 else math.inf
+        se = min(float(self.dry_se(hd)), self.max_se)
+        ret = [se]
+        step = 0.1
+        if self.stats is not None:
+            self.stats.h += 1
+        for target in h_path[1:].tolist():
+            if target != h:
+                se, step = self.theta_segment(se, h, target, p, step)
+                h = target
+            ret.append(se)
+        theta = np.array(ret) * (self.theta_s - self.theta_r) + self.theta_r
+        if cont:
+            self.cos_g0 = self.contact(h, theta[-1])
+        return theta
+
+    def theta_segment(self, se, h, target, p, step):
+        """Integrate Se from h to target and return (Se, next step size)"""
+        sign = 1 if target < h else -1  # 1 for wetting and -1 for drying
+        stats = self.stats
+        if stats is not None:
+            stats.segments += 1
+            steps = stats.steps
+        # Drying from the main drying curve follows the main drying curve
+        if sign < 0 and h >= self.dry_h(min(se, self.max_se)):
+            if stats is not None:
+                stats.jumps += 1
+                stats.segment_steps[0] += 1
+            return min(float(self.dry_se(target)), self.max_se), step
+        d = self.theta_s - self.theta_r
+
+        def f(v, se):  # dSe/dv, where v = ln(h + atol)
+            h = max(math.exp(v) - self.atol, 0)
+            return self.dsedh(h, se * d + self.theta_r,
+                              sign, p) * (h + self.atol)
+        v, end = math.log(h + self.atol), math.log(target + self.atol)
+        direction = 1 if end > v else -1
+        k1 = f(v, se)
+        for _ in range(self.max_step):
+            last = step >= abs(end - v)
+            dv = end - v if last else direction * step
+            k2 = f(v + dv / 2, se + dv / 2 * k1)
+            k3 = f(v + dv * 3 / 4, se + dv * 3 / 4 * k2)
+            se_new = se + dv * (2 / 9 * k1 + 1 / 3 * k2 + 4 / 9 * k3)
+            k4 = f(v + dv, se_new)
+            err = abs(dv * (-5 / 72 * k1 + 1 / 12 * k2 +
+                      1 / 9 * k3 - 1 / 8 * k4)) / self.rtol
+            if err > 1:  # Reject the step
+                step = abs(dv) * max(0.2, 0.9 * err**(-1 / 3))
+                if stats is not None:
+                    stats.rejected += 1
+                continue
+            v = end if last else v + dv
+            if stats is not None:
+                stats.steps += 1
+            # Clamp to the main drying curve and max_se
+            sd = min(float(self.dry_se(target if last else math.exp(v) - self.atol)),
+                     self.max_se)
+            if se_new > sd:
+                se_new = sd
+                k4 = f(v, se_new)
+                if stats is not None:
+                    stats.clamps += 1
+            se, k1 = se_new, k4
+            if last:
+                if stats is not None:
+                    stats.segment_steps[stats.steps - steps] += 1
+                return se, step
+            step = abs(dv) * (min(5, 0.9 * err**(-1 / 3)) if err > 0 else 5)
+        raise NumericalError(
+            'Error: maximum number of steps exceeded in the inverse integrator.', value=(h, target))
+
+    # Dense output
+
+    def h_dense(self, p, x, n=None, cont=True):
+        """Calculate hysteresis and return the trajectory recorded in the integration
+
+        All the states of the integration are returned, so that a smooth curve can be
+        drawn with a single integration. The adaptive integrator fills its steps by
+        cubic Hermite interpolation, and the main drying curve is filled where the
+        integrator jumps along it, with spacing of self.dense_step in the arc length of
+        the (Se, ln h) plane. With the legacy integrator, all the steps of
+        self.delta_theta are returned, and the values at the points of x are the same
+        as h method. Where drying reaches the main drying curve, the legacy integrator
+        jumps to the end of the interval keeping h of the curve where it jumps, and the
+        trajectory is a straight line from there.
+
+        input
+
+            p, x and cont are the same as h method
+            n : if given, the trajectory is decimated to about n points by curvature,
+                keeping the points of x
+
+        returns (theta, h, cos_g) arrays, where cos_g is cos of the contact angle
+        """
+        se, h, node = self.trajectory(p, x, cont)
+        if n is not None:
+            keep = self.decimate(se, h, node, n)
+            se, h = se[keep], h[keep]
+        hd = self.dry_h(np.minimum(se, self.max_se))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cos_g = np.where(hd > 0, self.cos_gr * h / hd, self.cos_gr)
+        theta = se * (self.theta_s - self.theta_r) + self.theta_r
+        return theta, h, cos_g
+
+    def trajectory(self, p, x, cont=True):
+        """Calculate hysteresis and return the states recorded in the integration
+
+        returns (Se, h, node) arrays, where node is True at the points of x
+        """
+        self.trace = []
+        try:
+            self.h(p, x, cont)
+            se, h, node = (np.array(a) for a in zip(*self.trace))
+        finally:
+            self.trace = None
+        return se, h, node
+
+    def trace_step(self, y0, y1, k0, k1, step):
+        """Record interpolated states within a step of the adaptive integrator"""
+        num = math.ceil(step / self.dense_step)
+        for j in range(1, num):
+            t = j / num
+            t1 = 1 - t
+            se, h = [(y0[i] * (1 + 2 * t) + k0[i] * step * t) * t1 * t1 +
+                     (y1[i] * (3 - 2 * t) - k1[i] * step * t1) * t * t for i in range(2)]
+            self.trace.append((se, max(h, 0), False))
+
+    def trace_drying(self, se0, se1):
+        """Record states on the main drying curve between se0 and se1"""
+        h0, h1 = (float(self.dry_h(min(se, self.max_se))) for se in (se0, se1))
+        arc = abs(se1 - se0) + \
+            abs(math.log((h1 + self.atol) / (h0 + self.atol)))
+        num = math.ceil(arc / self.dense_step)
+        for se in np.linspace(se0, se1, num + 1)[1:-1]:
+            self.trace.append(
+                (float(se), float(self.dry_h(min(se, self.max_se))), False))
+
+    def decimate(self, se, h, node, n):
+        """Indices of about n points of a trajectory selected by curvature
+
+        Points are selected at equal intervals of the arc length plus the turning
+        angle in the (Se, ln h) plane, both normalized by their total, so that half of
+        the points are placed where the curve bends. The points marked in node are
+        kept, and the turning angle at them is not counted.
+        """
+        d = np.diff(np.array([se, np.log(h + self.atol)]), axis=1)
+        length = np.hypot(*d)
+        angle = np.abs(np.diff(np.unwrap(np.arctan2(d[1], d[0]))))
+        angle[node[1:-1]] = 0
+        w = np.concatenate(([0], np.cumsum(length) / length.sum()))
+        if angle.sum() > 0:
+            w[1:-1] += np.cumsum(angle) / angle.sum()
+            w[-1] += 1
+        keep = np.searchsorted(w, np.linspace(0, w[-1], n))
+        return np.union1d(np.minimum(keep, len(se) - 1), np.flatnonzero(node))
+
+    # Batch evaluation of many sets of hysteresis parameters
+
+    def h_batch(self, P, x, cos_g0=None):
+        """Calculate hysteresis for many sets of hysteresis parameters at once
+
+        All sets of parameters are integrated together as numpy arrays with the
+        integrator selected by self.integrator. With the legacy integrator, whether
+        drying on the main drying curve jumps along it is decided by rounding, and
+        numpy rounds differently from math, so that a row can differ from h method
+        where drying reaches the main drying curve.
+
+        A step of the arrays costs much more than a step of h method, so that it is
+        faster than h method for each row only for more than about 20 to 30 rows.
+
+        input
+
+            P = ((cos(theta_A), b), ...) : array of shape (k, 2)
+            x = (theta_0, theta_1, theta_2, ...)
+            cos_g0 : cos of the initial contact angle (scalar or array of shape (k,))
+                     self.cos_g0 is used when it is None
+
+        returns array of h with shape (k, len(x))
+        """
+        if cos_g0 is None:
+            cos_g0 = self.cos_g0
+        self.check_theta(x)
+        P = np.atleast_2d(np.asarray(P, dtype=float))
+        x = np.asarray(x, dtype=float)
+        h = np.ones(len(P)) * self.dry_h((x[0] - self.theta_r) /
+                                         (self.theta_s - self.theta_r)) * cos_g0 / self.cos_gr
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            if self.integrator == 'adaptive':
+                ret = self.h_batch_adaptive(P, x, h)
+            else:
+                ret = self.h_batch_legacy(P, x, h)
+        if np.isnan(ret).any():
+            i = tuple(int(j) for j in np.argwhere(np.isnan(ret))[0])
+            raise NumericalError(
+                'Error: h was not calculated.', index=i, value=tuple(P[i[0]]))
+        return ret
+
+    def dsedh_array(self, h, se, sign, cos_ga, b):
+        """dSe/dh of eq. 11 in Zhao (2013) for arrays of h and Se
+
+        sign is 1 for wetting and -1 for drying (scalar or array), and cos_ga and b
+        are arrays of hysteresis parameters. Floating point errors should be ignored by
+        the caller.
+        """
+        hd = self.dry_h(np.minimum(se, self.max_se))
+        valid = (h > 0) & (hd > 0)
+        hd = np.where(valid, hd, 1.0)
+        h = np.where(valid, h, 1.0)
+        cos_g = self.cos_gr * h / hd
+        k = np.where(sign < 0, cos_g - self.cos_gr, cos_ga - cos_g)
+        k = np.minimum(np.maximum(k / (cos_ga - self.cos_gr), 0), 1) ** b
+        dsedh = self.dry_c(hd) * (hd / h * (1 - k))
+        return np.where(valid, dsedh, 0.0)
+
+    def h_batch_legacy(self, P, x, h):
+        """Fixed step integration of h_legacy for each row of P"""
+        cos_ga, b = P[:, 0], P[:, 1]
+        theta = np.full(len(P), x[0])
+        ret = np.empty((len(P), len(x)))
+        ret[:, 0] = h
+        for j in range(1, len(x)):
+            h, theta = self.h_segment_array_legacy(h, theta, x[j], cos_ga, b)
+            ret[:, j] = h
+        return ret
+
+    def h_segment_array_legacy(self, h, theta, t, cos_ga, b):
+        """Integrate h of each lane from theta to t with fixed step and return (h, theta)
+
+        theta and t are scalars or arrays, so that each lane can be drying or wetting.
+        """
+        d = self.theta_s - self.theta_r
+        t = np.minimum(t, self.max_se * d + self.theta_r)
+        sign = np.where(t < theta, -1, 1)
+        active = theta != t
+        while active.any():
+            jump = active & (
+                (self.dry_se(h) *
+                 self.max_se < (
+                    theta -
+                    self.theta_r) /
+                    d) & (
+                    sign < 0) | (
+                    h == 0))
+            h = np.where(jump, self.dry_h((theta - self.theta_r) / d), h)
+            theta = np.where(jump, t, theta)
+            step = active & ~jump
+            dt = np.clip(t - theta, -self.delta_theta, self.delta_theta)
+            dse = dt / d
+            dsedh = self.dsedh_array(
+                h, (theta - self.theta_r) / d, sign, cos_ga, b)
+            small = np.abs(dse) < self.delta_h * np.abs(dsedh)
+            dh = np.where(small, dse / dsedh, -self.delta_h * np.sign(dt))
+            dt = np.where(small, dt, dh * dsedh * d)
+            h = np.where(step, np.maximum(h + dh, 0), h)
+            theta = np.where(step, theta + dt, theta)
+            hd = self.dry_h((theta - self.theta_r) / d)
+            h = np.where(step & (h > hd), hd, h)
+            active = theta != t
+        return h, theta
+
+    def arc_array(self, se, h, sign, cos_ga, b):
+        """Tangent (dSe/ds, dh/ds) of arc for arrays of Se and h"""
+        h = np.maximum(h, 0)
+        dsedh = self.dsedh_array(h, se, sign, cos_ga, b)
+        g = -sign / np.sqrt(dsedh**2 + (h + self.atol)**-2)
+        return g * dsedh, g
+
+    def h_batch_adaptive(self, P, x, h):
+        """Adaptive integration of h_adaptive for each row of P"""
+        cos_ga, b = P[:, 0], P[:, 1]
+        se_x = (x - self.theta_r) / (self.theta_s - self.theta_r)
+        ret = np.empty((len(P), len(x)))
+        ret[:, 0] = h
+        se = se_x[0]
+        step = np.full(len(P), 0.01)
+        for j in range(1, len(x)):
+            target = min(se_x[j], self.max_se)
+            if target != se:
+                h = self.h_segment_array(h, se, target, cos_ga, b, step)
+                se = target
+            ret[:, j] = h
+        return ret
+
+    def h_segment_array(self, h, se_start, target, cos_ga, b, step):
+        """Integrate h of each lane from se_start to target (step is updated in place)
+
+        se_start and target are scalars or arrays, so that each lane can be drying or
+        wetting.
+        """
+        sign = np.where(target > se_start, 1, -1)
+        se = np.full(len(h), se_start, dtype=float)
+        h_end = self.dry_h(target)
+        # Drying from the main drying curve or from h = 0 follows the main
+        # drying curve
+        done = (h <= 0) | (sign < 0) & (
+            h >= self.dry_h(np.minimum(se_start, self.max_se)))
+        done &= se != target
+        h = np.where(done, h_end, h)
+        done |= se == target
+        k1 = self.arc_array(se, h, sign, cos_ga, b)
+        for _ in range(self.max_step):
+            if done.all():
+                return h
+            ds = np.where(done, 0, step)
+            k2 = self.arc_array(se + ds / 2 * k1[0], h + ds / 2 * k1[1],
+                                sign, cos_ga, b)
+            k3 = self.arc_array(se + ds * 3 / 4 * k2[0], h + ds * 3 / 4 * k2[1],
+                                sign, cos_ga, b)
+            se_new = se + ds * (2 / 9 * k1[0] + 1 / 3 * k2[0] + 4 / 9 * k3[0])
+            h_new = h + ds * (2 / 9 * k1[1] + 1 / 3 * k2[1] + 4 / 9 * k3[1])
+            k4 = self.arc_array(se_new, h_new, sign, cos_ga, b)
+            e_se, e_h = [ds * (-5 / 72 * k1[i] + 1 / 12 * k2[i] + 1 / 9 * k3[i] - 1 / 8 * k4[i])
+                         for i in range(2)]
+            err = np.maximum(np.abs(e_se) / self.rtol, np.abs(e_h) /
+                             (self.atol + self.rtol * np.maximum(np.abs(h), np.abs(h_new))))
+            factor = 0.9 * err**(-1 / 3)
+            over = sign * (se_new - target)
+            reject = ~done & (err > 1)
+            shorten = ~done & ~reject & (over > 1e-12)
+            accept = ~done & ~reject & ~shorten
+            step[:] = np.select([reject, shorten, accept],
+                                [ds * np.maximum(0.2, factor),
+                                 ds * (target - se) / (se_new - se),
+                                 ds * np.minimum(5, factor)], step)
+            se = np.where(accept, se_new, se)
+            h = np.where(accept, h_new, h)
+            k1 = (np.where(accept, k4[0], k1[0]),
+                  np.where(accept, k4[1], k1[1]))
+            hd = self.dry_h(np.minimum(se, self.max_se))
+            main = accept & ((h <= 0) | (h >= hd) & (sign < 0))
+            clamp = accept & ~main & (h > hd)
+            h = np.where(main, h_end, np.where(clamp, hd, h))
+            done |= main | accept & (over > -1e-12)
+            if clamp.any():
+                k1 = self.arc_array(se, h, sign, cos_ga, b)
+        raise NumericalError(
+            'Error: maximum number of steps exceeded in the adaptive integrator.', value=(se_start, target))
+
+    def contact(self, h, theta):
+        """Get cosine of contact angle
+
+        input
+
+            h = pressure head
+            theta = water content
+
+        returns cos(contact angle)
+        """
+        se = theta / (self.theta_s - self.theta_r) + self.theta_r
+        if se >= 1:
+            return 1
+        cos_g = h / self.dry_h(se) * self.cos_gr
+        return cos_g
+
+    def smooth_theta(self, theta, delta=0.005, p=None, tol=None):
+        """Get theta for drawing smooth curve
+
+        Each interval is divided into floor(|theta_1 - theta_0| / delta) + 1 steps.
+        When p and tol are given, points are placed adaptively instead, so that ln(h)
+        of the hysteresis with p, linearly interpolated between the points, is within
+        tol of the curve. The curve is calculated by a single integration from
+        self.cos_g0 (see h_dense), which is not changed.
+
+        input
+            theta = (theta_0, theta_1, theta_2, ...)
+            delta = increment (upper limit)
+            p = (cos(theta_A), b) for the adaptive placement
+            tol = tolerance of ln(h) for the adaptive placement
+
+        returns (theta_0, theta_0+delta, ...., theta_1, ...)
+        """
+        if len(theta) < 2:
+            return theta
+        theta = np.asarray(theta, dtype=float)
+        if tol is not None:
+            if p is None:
+                raise InputError(
+                    'Hysteresis parameters p are required with tol.', value=tol)
+            return self.smooth_theta_adaptive(theta, p, tol)
+        start, stop = theta[:-1], theta[1:]
+        num = np.floor(np.abs(stop - start) / delta).astype(int) + 2
+        # Each interval is np.linspace(start, stop, num) filled in one array
+        first = np.cumsum(num) - num
+        interval = np.repeat(np.arange(len(num)), num)
+        step = (stop - start) / (num - 1)
+        smooth = (np.arange(num.sum()) - first[interval]) * \
+            step[interval] + start[interval]
+        smooth[first + num - 1] = stop
+        return smooth
+
+    def smooth_theta_adaptive(self, theta, p, tol):
+        """smooth_theta with points placed by tolerance of ln(h)"""
+        se, h, node = self.trajectory(p, theta, cont=False)
+        t = se * (self.theta_s - self.theta_r) + self.theta_r
+        y = np.log(h + self.atol)
+        index = np.flatnonzero(node)
+        smooth = []
+        for i in range(1, len(theta)):
+            a, b = index[i - 1], index[i]
+            keep = a + self.simplify(t[a:b + 1], y[a:b + 1], tol)
+            part = t[keep]
+            # Ends are the given theta, which can differ by rounding or max_se
+            part[0], part[-1] = theta[i - 1], theta[i]
+            smooth.append(part)
+        return np.concatenate(smooth)
+
+    @staticmethod
+    def simplify(t, y, tol):
+        """Indices of points of curve y(t) approximated within tol by linear interpolation
+
+        Points are added where the error is largest until it is within tol (the
+        algorithm of Ramer, Douglas and Peucker in the vertical distance).
+        """
+        keep = np.zeros(len(t), dtype=bool)
+        keep[[0, -1]] = True
+        intervals = [(0, len(t) - 1)]
+        while intervals:
+            i, j = intervals.pop()
+            if j - i < 2:
+                continue
+            k = np.arange(i + 1, j)
+            w = (t[k] - t[i]) / (t[j] - t[i]) if t[j] != t[i] else 0
+            error = np.abs(y[k] - y[i] - w * (y[j] - y[i]))
+            m = int(np.argmax(error))
+            if error[m] > tol:
+                keep[k[m]] = True
+                intervals += [(i, k[m]), (k[m], j)]
+        return np.flatnonzero(keep)
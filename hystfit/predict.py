@@ -0,0 +1,193 @@
+"""Prediction of h with fitted parameters, which depends only on NumPy.
+
+Neither unsatfit nor scipy is imported, so that a process evaluating h with known
+parameters starts quickly.
+"""
+import json
+import math
+import numpy as np
+from .errors import InputError
+from .model import Model
+
+# File of many models saved by save_models: MAGIC, the version of the format
+# (major, minor) and zero padding to 16 bytes, followed by the records and
+# the nodes of tables in the format of .npy files
+MAGIC = b'\x93HYSTFIT'
+VERSION = (1, 1)
+RECORD = np.dtype([('model', '<U2'), ('theta_s', '<f8'), ('theta_r', '<f8'),
+                   ('swrf_p', '<f8', (5,)), ('cos_gr', '<f8'),
+                   ('hyst', '<f8', (2,)), ('cos_g0', '<f8'),
+                   ('integrator', '<U8'), ('delta_theta', '<f8'),
+                   ('delta_h', '<f8'), ('rtol', '<f8'), ('atol', '<f8'),
+                   ('max_step', '<i8'), ('max_se', '<f8'), ('table_rtol', '<f8'),
+                   ('table_z', '<f8', (2,)), ('table_start', '<i8'),
+                   ('table_size', '<i8')])
+
+
+class Predictor(Model):
+    """Calculation of h with a parameter set given by Fit.params()
+
+    input
+
+        params : dictionary of the model and parameters of the drying curve,
+                 cos(gamma_R), hysteresis parameters and cos_g0
+        table : nodes of the table of the drying curve (see Table), or None
+    """
+
+    def __init__(self, params, table=None):
+        super(Predictor, self).__init__()
+        self.set_params(params)
+        if table is not None:  # nodes of the table saved by save_models
+            self.set_table(table)
+
+    def predict(self, theta, cont=True):
+        """Calculate h with self.hyst for theta = (theta_0, theta_1, ...)
+
+        The last contact angle is remembered for the next call when cont is True.
+
+        returns array of h
+        """
+        return np.array(self.h(self.hyst, theta, cont))
+
+    def predict_theta(self, h, cont=True):
+        """Calculate water content with self.hyst for h = (h_0, h_1, ...)
+
+        The last contact angle is remembered for the next call when cont is True.
+
+        returns array of theta
+        """
+        return self.theta(self.hyst, h, cont)
+
+
+def save(model, file):
+    """Save the parameters of hystfit.Fit or Predictor object as JSON"""
+    with open(file, 'w') as f:
+        json.dump(model.params(), f)
+
+
+def load(file):
+    """Load parameters saved by save and return Predictor"""
+    with open(file) as f:
+        return Predictor(json.load(f))
+
+
+def save_models(file, models, tables=True):
+    """Save many models in a file, which can be memory-mapped by load_models
+
+    The parameters, the current contact angle, the settings of the integrators and
+    the tabulated drying curve of each model are saved.
+
+    input
+
+        file : path of the file
+        models : iterable of hystfit.Fit or Predictor objects
+        tables : if False, tables of the drying curve are not saved and they are
+                 built when the models are used
+    """
+    models = list(models)
+    records = np.zeros(len(models), dtype=RECORD)
+    nodes = []
+    start = 0
+    for r, m in zip(records, models):
+        p = m.params()
+        r['model'] = p['model']
+        r['theta_s'], r['theta_r'] = p['theta_s'], p['theta_r']
+        r['swrf_p'] = p['swrf_p'] + [math.nan] * \
+            (len(r['swrf_p']) - len(p['swrf_p']))
+        r['cos_gr'], r['cos_g0'] = p['cos_gr'], p['cos_g0']
+        r['hyst'] = p['hyst'] if p['hyst'] else [math.nan] * 2
+        for key, value in p['settings'].items():
+            r[key] = math.nan if value is None else value
+        if tables and m.table_rtol is not None:
+            m.set_table()
+        if tables and m.table is not None:
+            t = m.table
+            r['table_z'] = t.z[0], t.z[-1]
+            r['table_start'], r['table_size'] = start, len(t.z)
+            nodes.append(np.column_stack((t.s, t.c, t.dc)))
+            start += len(t.z)
+    with open(file, 'wb') as f:
+        f.write((MAGIC + bytes(VERSION)).ljust(16, b'\0'))
+        for a in records, np.concatenate(
+                nodes or [np.zeros((0, 3))]).astype('<f8'):
+            np.lib.format.write_array(f, a)
+            f.write(bytes(-f.tell() % 16))
+
+
+def load_models(file):
+    """Load models saved by save_models as ModelFile"""
+    return ModelFile(file)
+
+
+class ModelFile:
+    """Models in a file saved by save_models
+
+    The records and tables are memory-mapped, and a model is loaded as Predictor
+    by index, e.g. models[i], when it is used.
+
+    input
+
+        file : path of the file
+    """
+
+    def __init__(self, file):
+        with open(file, 'rb') as f:
+            head = f.read(16)
+            if not head.startswith(MAGIC):
+                raise InputError(f'{file} is not a file of hystfit models.')
+            version = tuple(head[len(MAGIC):len(MAGIC) + 2])
+            if version[0] != VERSION[0]:
+                raise InputError(
+                    f'Version {version} of the file is not supported.', value=version)
+            self.records = self.read_array(f, file)
+            self.tables = self.read_array(f, file)
+
+    @staticmethod
+    def read_array(f, file):
+        """Memory-map the array at the position of f and move f to the next one"""
+        fmt = np.lib.format
+        version = fmt.read_magic(f)
+        if version == (1, 0):
+            shape, fortran, dtype = fmt.read_array_header_1_0(f)
+        else:
+            shape, fortran, dtype = fmt.read_array_header_2_0(f)
+        offset = f.tell()
+        size = dtype.itemsize * math.prod(shape)
+        f.seek(offset + size + (-(offset + size) % 16))
+        if size == 0:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(file, dtype=dtype, mode='r', offset=offset, shape=shape,
+                         order='F' if fortran else 'C')
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, i):
+        r = self.records[i]
+        table = None
+        if r['table_size']:
+            start = r['table_start']
+            nodes = self.tables[start:start + r['table_size']]
+            table = (float(r['table_z'][0]), float(r['table_z'][1]),
+                     nodes[:, 0], nodes[:, 1], nodes[:, 2])
+        return Predictor(self.params(i), table)
+
+    def params(self, i):
+        """Dictionary of the parameters of the i-th model as given by Model.params"""
+        r = self.records[i]
+        table_rtol = float(r['table_rtol'])
+        return {'model': str(r['model']),
+                'theta_s': float(r['theta_s']),
+                'theta_r': float(r['theta_r']),
+                'swrf_p': [float(v) for v in r['swrf_p'] if not math.isnan(v)],
+                'cos_gr': float(r['cos_gr']),
+                'hyst': [float(v) for v in r['hyst'] if not math.isnan(v)],
+                'cos_g0': float(r['cos_g0']),
+                'settings': {'integrator': str(r['integrator']),
+                             'delta_theta': float(r['delta_theta']),
+                             'delta_h': float(r['delta_h']),
+                             'rtol': float(r['rtol']),
+                             'atol': float(r['atol']),
+                             'max_step': int(r['max_step']),
+                             'max_se': float(r['max_se']),
+                             'table_rtol': None if math.isnan(table_rtol) else table_rtol}}
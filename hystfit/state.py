@@ -0,0 +1,105 @@
+"""Streaming calculation of hysteresis for long time series of water content."""
+import numpy as np
+
+
+class HysteresisState:
+    """State of hysteresis updated with chunks of water content
+
+    The state is continued from a chunk to the next one, so that a long time series
+    is calculated chunk by chunk with the same result as a single call of Fit.h,
+    using the integrator selected by fit.integrator.
+
+    input
+
+        fit : hystfit.Fit object with the drying curve set
+        p = (cos(theta_A), b)
+        theta, h : initial state. When h is None, h is calculated from
+                   fit.cos_g0 at the first water content.
+    """
+
+    __slots__ = ('fit', 'p', 'theta', 'h', 'cos_g', 'step')
+
+    def __init__(self, fit, p, theta=None, h=None):
+        self.fit = fit
+        self.p = tuple(float(v) for v in p)
+        self.theta = theta
+        self.h = h
+        self.cos_g = None  # cos of the contact angle
+        self.step = 0.01  # step size of the adaptive integrator
+        if theta is not None:
+            self.start(theta)
+
+    def start(self, theta):
+        """Set the initial state at theta"""
+        f = self.fit
+        self.theta = float(theta)
+        if self.h is None:
+            se = (self.theta - f.theta_r) / (f.theta_s - f.theta_r)
+            self.h = float(f.dry_h(se) * f.cos_g0 / f.cos_gr)
+        self.set_contact()
+
+    def set_contact(self):
+        """Calculate cos of the contact angle from the current state"""
+        f = self.fit
+        se = (self.theta - f.theta_r) / (f.theta_s - f.theta_r)
+        hd = float(f.dry_h(min(se, f.max_se)))
+        self.cos_g = f.cos_gr * self.h / hd if hd > 0 else f.cos_gr
+
+    def update(self, chunk):
+        """Calculate h for a chunk of water content and update the state
+
+        returns array of h for the chunk
+        """
+        f = self.fit
+        chunk = np.asarray(chunk, dtype=float)
+        ret = np.empty(len(chunk))
+        if len(chunk) == 0:
+            return ret
+        f.check_theta(chunk)
+        i = 0
+        if self.theta is None:
+            self.start(chunk[0])
+            ret[0] = self.h
+            i = 1
+        h, theta, step, p = self.h, self.theta, self.step, self.p
+        if f.integrator == 'adaptive':
+            d = f.theta_s - f.theta_r
+            se = (theta - f.theta_r) / d
+            if i == 0:  # Se was fixed to max_se at the end of the last chunk
+                se = min(se, f.max_se)
+            for t in chunk[i:].tolist():
+                target = min((t - f.theta_r) / d, f.max_se)
+                if target != se:
+                    h, step, _ = f.h_segment(h, se, target, p, step)
+                    se = target
+                ret[i] = h
+                i += 1
+            theta = chunk[-1]
+        else:
+            for t in chunk[i:].tolist():
+                h, theta = f.h_legacy_segment(h, theta, t, p)
+                ret[i] = h
+                i += 1
+        self.h, self.theta, self.step = float(h), float(theta), step
+        self.set_contact()
+        return ret
+
+    def stream(self, chunks):
+        """Generator of arrays of h for an iterable of chunks of water content"""
+        for chunk in chunks:
+            yield self.update(chunk)
+
+    def checkpoint(self):
+        """Dictionary of the state, which can be saved as JSON and restored"""
+        return {'p': list(self.p), 'theta': self.theta, 'h': self.h,
+                'step': self.step}
+
+    @classmethod
+    def restore(cls, fit, checkpoint):
+        """Restore a state from checkpoint with fit set in the same way"""
+        state = cls(fit, checkpoint['p'])
+        state.h = checkpoint['h']
+        state.step = checkpoint['step']
+        if checkpoint['theta'] is not None:
+            state.start(checkpoint['theta'])
+        return state
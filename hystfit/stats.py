@@ -0,0 +1,73 @@
+"""Performance counters of hystfit."""
+import collections
+import contextlib
+import time
+
+
+class Stats:
+    """Performance counters of a hystfit.Fit object
+
+    Counters are recorded while fit.stats is a Stats object, and nothing is
+    recorded when fit.stats is None (default). Steps, clamps and calls of dSe/dh
+    are counted by the integrators of h method, and calls of the drying curve are
+    counted by h, h_batch and the methods using them.
+
+    input
+
+        hook : function called as hook(phase, stats) at the end of each phase,
+               e.g. to send stats.as_dict() to a metrics system
+    """
+
+    def __init__(self, hook=None):
+        self.hook = hook
+        self.reset()
+
+    def reset(self):
+        """Set all counters to zero"""
+        self.h = 0  # calls of the integrators of h method
+        self.segments = 0  # segments integrated between water contents
+        self.steps = 0  # accepted steps
+        # histogram of the number of steps in a segment {steps: segments}
+        self.segment_steps = collections.Counter()
+        # rejected steps of the adaptive integrator, including steps shortened
+        # to land on the water content
+        self.rejected = 0
+        self.delta_h = 0  # steps of the legacy integrator limited by delta_h
+        self.clamps = 0  # h clamped to the main drying curve
+        self.jumps = 0  # segments following the main drying curve
+        self.dsedh = 0  # calls of dSe/dh of eq. 11 in Zhao (2013)
+        self.dry_h = 0  # calls of h(Se) of the drying curve
+        self.dry_c = 0  # calls of dSe/dh of the drying curve
+        self.cost = 0  # evaluations of the cost function in opt
+        self.jac = 0  # evaluations of the Jacobian by sensitivity equations in opt
+        self.time = {}  # wall time of each phase in seconds
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Context manager adding the wall time of a phase to self.time[name]"""
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.time[name] = self.time.get(
+                name, 0.0) + time.perf_counter() - start
+        if self.hook is not None:
+            self.hook(name, self)
+
+    def counter(self, name, func):
+        """Wrap func to count its calls in the counter of name"""
+        def wrapper(*args):
+            setattr(self, name, getattr(self, name) + 1)
+            return func(*args)
+        wrapper.wrapped = func
+        return wrapper
+
+    def as_dict(self):
+        """Flat dictionary of the counters, where time of a phase is time_<phase>"""
+        d = {key: getattr(self, key) for key in
+             ('h', 'segments', 'steps', 'rejected', 'delta_h', 'clamps', 'jumps',
+              'dsedh', 'dry_h', 'dry_c', 'cost', 'jac')}
+        d['max_segment_steps'] = max(self.segment_steps, default=0)
+        for key, value in self.time.items():
+            d[f'time_{key}'] = value
+        return d
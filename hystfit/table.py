@@ -0,0 +1,154 @@
+"""Tabulated drying curve for fast evaluation of Se(h), h(Se) and dSe/dh."""
+import bisect
+import math
+import numpy as np
+from .errors import NumericalError
+
+
+class Table:
+    """Piecewise cubic Hermite table of a drying curve
+
+    Nodes are equally spaced in ln(h). Se(h) and dSe/dh are interpolated in ln(h),
+    and ln(h) is interpolated in Se, all with exact derivatives at the nodes. The number of
+    nodes is doubled until the error at the midpoints of all intervals is below rtol
+    (relative for h and dSe/dh, absolute for Se). Outside of the range of the table,
+    the original functions are used.
+
+    input
+
+        se, h, c, dc : functions Se(h), h(Se), dSe/dh and d2Se/dh2 accepting arrays
+        rtol : tolerance of the table
+        se_range : range of Se covered by the table
+        h_max : upper limit of h covered by the table
+        nodes : (z_lo, z_hi, s, c, dc) of a table built before (see set_nodes),
+                which is used without building the table
+    """
+
+    def __init__(self, se, h, c, dc, rtol=1e-8,
+                 se_range=(1e-6, 1 - 1e-6), h_max=1e7, nodes=None):
+        self.f_se, self.f_h, self.f_c, self.f_dc = se, h, c, dc
+        self.rtol = rtol
+        if nodes is not None:
+            self.set_nodes(*nodes)
+            return
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            z_lo = math.log(float(h(se_range[1])))
+            z_hi = math.log(min(float(h(se_range[0])), h_max))
+            for n in 2**np.arange(4, 21):
+                self.build(z_lo, z_hi, n)
+                if self.error() < rtol:
+                    return
+        raise NumericalError(
+            'Error: table of drying curve does not converge.', value=self.error())
+
+    def build(self, z_lo, z_hi, n):
+        """Calculate nodes of the table"""
+        h = np.exp(np.linspace(z_lo, z_hi, n + 1))
+        self.set_nodes(z_lo, z_hi, self.f_se(h), self.f_c(h),
+                       h * np.asarray(self.f_dc(h), dtype=float))
+
+    def set_nodes(self, z_lo, z_hi, s, c, dc):
+        """Set nodes of the table from Se, dSe/dh and dC/dln(h) at the nodes"""
+        n = len(s) - 1
+        self.z = np.linspace(z_lo, z_hi, n + 1)
+        self.dz = (z_hi - z_lo) / int(n)
+        h = np.exp(self.z)
+        self.h_lo, self.h_hi = float(h[0]), float(h[-1])
+        self.s = np.asarray(s, dtype=float)
+        self.c = np.asarray(c, dtype=float)
+        self.ds = h * self.c  # dSe/dln(h)
+        self.dc = np.asarray(dc, dtype=float)  # dC/dln(h)
+        self.dzds = 1 / self.ds  # dln(h)/dSe
+        # Se in increasing order for h(Se)
+        self.s_inc = self.s[::-1].tolist()
+        self.s_lo, self.s_hi = float(self.s[-1]), float(self.s[0])
+        self.nodes = (self.z.tolist(), self.s.tolist(), self.c.tolist(),
+                      self.ds.tolist(), self.dc.tolist(), self.dzds.tolist())
+
+    def error(self):
+        """Maximum error at the midpoints of the intervals"""
+        z = (self.z[1:] + self.z[:-1]) / 2
+        h = np.exp(z)
+        se = np.asarray(self.f_se(h), dtype=float)
+        e_se = np.abs(self.se(h) - se)
+        e_c = np.abs(self.c_h(h) / np.asarray(self.f_c(h)) - 1)
+        e_h = np.abs(self.h(se) / h - 1)
+        return np.nanmax(np.concatenate((e_se, e_c, e_h)))
+
+    @staticmethod
+    def hermite(t, y0, y1, m0, m1, d):
+        """Cubic Hermite interpolation at t in [0, 1] of an interval of width d"""
+        t1 = 1 - t
+        return (y0 * (1 + 2 * t) + m0 * d * t) * t1 * t1 + \
+            (y1 * (3 - 2 * t) - m1 * d * t1) * t * t
+
+    def index(self, z):
+        """Index of the interval and position in the interval for arrays of ln(h)"""
+        x = (z - self.z[0]) / self.dz
+        i = np.clip(np.floor(x).astype(int), 0, len(self.z) - 2)
+        return i, x - i
+
+    def se(self, h):  # Se(h)
+        if isinstance(h, float):
+            if not self.h_lo <= h <= self.h_hi:
+                return self.f_se(h)
+            z, s, c, ds, dc, dzds = self.nodes
+            x = (math.log(h) - z[0]) / self.dz
+            i = min(int(x), len(z) - 2)
+            t = x - i
+            t1 = 1 - t
+            return (s[i] * (1 + 2 * t) + ds[i] * self.dz * t) * t1 * t1 + \
+                (s[i + 1] * (3 - 2 * t) - ds[i + 1] * self.dz * t1) * t * t
+        h = np.asarray(h, dtype=float)
+        inside = (h >= self.h_lo) & (h <= self.h_hi)
+        i, t = self.index(np.log(np.where(inside, h, self.h_lo)))
+        return np.where(inside, self.hermite(t, self.s[i], self.s[i + 1],
+                                             self.ds[i], self.ds[i + 1], self.dz), self.f_se(h))
+
+    def c_h(self, h):  # dSe/dh
+        if isinstance(h, float):
+            if not self.h_lo <= h <= self.h_hi:
+                return self.f_c(h)
+            z, s, c, ds, dc, dzds = self.nodes
+            x = (math.log(h) - z[0]) / self.dz
+            i = min(int(x), len(z) - 2)
+            t = x - i
+            t1 = 1 - t
+            return (c[i] * (1 + 2 * t) + dc[i] * self.dz * t) * t1 * t1 + \
+                (c[i + 1] * (3 - 2 * t) - dc[i + 1] * self.dz * t1) * t * t
+        h = np.asarray(h, dtype=float)
+        inside = (h >= self.h_lo) & (h <= self.h_hi)
+        i, t = self.index(np.log(np.where(inside, h, self.h_lo)))
+        return np.where(inside, self.hermite(t, self.c[i], self.c[i + 1],
+                                             self.dc[i], self.dc[i + 1], self.dz), self.f_c(h))
+
+    def h(self, se):  # h(Se)
+        if isinstance(se, float):
+            if not self.s_lo <= se <= self.s_hi:
+                return self.f_h(se)
+            z, s, c, ds, dc, dzds = self.nodes
+            # Node j in increasing order of Se is node n - j in the table
+            n = len(z) - 1
+            i = n - max(bisect.bisect_right(self.s_inc, se), 1)
+            d = s[i + 1] - s[i]
+            t = (se - s[i]) / d
+            t1 = 1 - t
+            return math.exp((z[i] * (1 + 2 * t) + dzds[i] * d * t) * t1 * t1 +
+                            (z[i + 1] * (3 - 2 * t) - dzds[i + 1] * d * t1) * t * t)
+        se = np.asarray(se, dtype=float)
+        inside = (se >= self.s_lo) & (se <= self.s_hi)
+        n = len(self.z) - 1
+        j = np.searchsorted(
+            self.s_inc,
+            np.where(
+                inside,
+                se,
+                self.s_lo),
+            side='right')
+        i = n - np.clip(j, 1, n)
+        d = self.s[i + 1] - self.s[i]
+        t = (se - self.s[i]) / d
+        with np.errstate(over='ignore', invalid='ignore'):
+            h = np.exp(self.hermite(t, self.z[i], self.z[i + 1],
+                                    self.dzds[i], self.dzds[i + 1], d))
+            return np.where(inside, h, self.f_h(se))
@@ -47,6 +47,7 @@ setup(
     keywords='soil',
     packages=['hystfit'],
     package_data={'hystfit': ['data/*']},
+    entry_points={'console_scripts': ['hystfit = hystfit.cli:main']},
     install_requires=['unsatfit'],
     python_requires=">=3.10",
 )